@@ -0,0 +1,112 @@
+# Reading and writing FaceGen faces directly in zip and tar archives
+# by DongWon Oh (dongwonohphd@gmail.com)
+#
+# Members are read into memory and decoded with the in-memory .fg codec of FGBinTools
+# (decodeFGBatch, encodeFGBatch), so archives never have to be extracted to disk. Tar archives,
+# compressed or not, are read as a stream in one pass; zip archives are read member by member.
+# Face names are the member file names without directory and .fg extension, as in readFGBatch.
+
+import os
+import io
+import time
+import tarfile
+import zipfile
+import numpy as np
+from FGBinTools import decodeFGBatch, encodeFGBatch, FG_NCOORDS
+
+# archive extensions and the tarfile compression they stand for ('zip' for zip files)
+ARCHIVE_TYPES = (('.zip', 'zip'), ('.tar', ''), ('.tar.gz', 'gz'), ('.tgz', 'gz'),
+                 ('.tar.bz2', 'bz2'), ('.tbz2', 'bz2'), ('.tar.xz', 'xz'), ('.txz', 'xz'))
+
+def archiveType(fileName):
+    for extension, kind in ARCHIVE_TYPES:
+        if fileName.lower().endswith(extension):
+            return kind
+    return None
+
+def isArchive(fileName):
+    return archiveType(fileName) is not None
+
+# yields (member name, bytes) for every .fg member of a zip or tar archive
+def iterArchiveMembers(archiveFileName):
+    if archiveType(archiveFileName) == 'zip' or zipfile.is_zipfile(archiveFileName):
+        with zipfile.ZipFile(archiveFileName) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith('.fg'):
+                    yield info.filename, archive.read(info)
+    else:
+        with tarfile.open(archiveFileName, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith('.fg'):
+                    yield member.name, archive.extractfile(member).read()
+
+# decodes the .fg members of an archive chunkSize at a time; yields (names, (n, 130) int16 coords)
+def iterArchiveFG(archiveFileName, chunkSize=10000):
+    members = iterArchiveMembers(archiveFileName)
+    while True:
+        chunk = [member for _, member in zip(range(chunkSize), members)]
+        if not chunk:
+            break
+        names, coords = decodeFGBatch([name for name, _ in chunk], [buf for _, buf in chunk])
+        yield np.array([os.path.splitext(os.path.basename(name))[0] for name in names], dtype=str), coords
+
+# reads all faces of an archive; returns (names, (N, 130) int16 coords) like readFGBatch
+def readArchiveFG(archiveFileName, chunkSize=10000):
+    chunks = list(iterArchiveFG(archiveFileName, chunkSize))
+    if not chunks:
+        return np.array([], dtype=str), np.zeros((0, FG_NCOORDS), dtype=np.int16)
+    return np.concatenate([names for names, _ in chunks]), np.concatenate([coords for _, coords in chunks])
+
+# Writes faces into a new zip (deflated) or tar archive (compressed as its extension says) in
+# batches, without temporary files:
+#   with FGArchiveWriter('faces.tar.gz') as archive:
+#       archive.write(names, coords)
+class FGArchiveWriter:
+
+    def __init__(self, archiveFileName):
+        kind = archiveType(archiveFileName)
+        if kind is None:
+            raise ValueError("%s is not a zip or tar archive name." % archiveFileName)
+        self.fileName = archiveFileName
+        if kind == 'zip':
+            self.archive = zipfile.ZipFile(archiveFileName, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            self.archive = tarfile.open(archiveFileName, 'w:' + kind if kind else 'w')
+        self.count = 0
+
+    # adds one .fg member per row of (N, 100) or (N, 130) coordinates; returns True or False
+    def write(self, names, coords):
+        names = list(names)
+        if len(names) != len(coords):
+            print("Expected one name per row of coordinates.")
+            return False
+        data = encodeFGBatch(coords)
+        if data is False:
+            return False
+
+        now = time.time()
+        for name, buf in zip(names, data):
+            memberName = name if name.endswith('.fg') else name + '.fg'
+            if isinstance(self.archive, zipfile.ZipFile):
+                self.archive.writestr(memberName, buf.tobytes())
+            else:
+                info = tarfile.TarInfo(memberName)
+                info.size = len(buf)
+                info.mtime = now
+                self.archive.addfile(info, io.BytesIO(buf))
+        self.count += len(names)
+        return True
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# writes faces into a new archive; returns True or False
+def writeArchiveFG(archiveFileName, names, coords):
+    with FGArchiveWriter(archiveFileName) as archive:
+        return archive.write(names, coords)
@@ -0,0 +1,156 @@
+# Packed storage for large collections of FaceGen faces
+# by DongWon Oh (dongwonohphd@gmail.com)
+#
+# A corpus file holds many .fg faces in one file: a 32-byte header followed by fixed-width
+# records of a null-padded name and the SS | SA | TS | TA int16 coordinates of one face
+# (the same layout readFGBatch returns). The records are memory-mapped, so rows are
+# returned as views on the file, and new faces are appended at the end without
+# rewriting the records already stored.
+
+import os
+import numpy as np
+from FGBinTools import readFGBatch, writeFGBatch, FG_NCOORDS
+
+CORPUS_HEADER = np.dtype([('magic', 'S8'), ('nCoords', '<u4'), ('nameWidth', '<u4'),
+                          ('count', '<u8'), ('reserved', 'S8')])
+
+def _recordDtype(nameWidth, nCoords):
+    return np.dtype([('name', 'S%i' % nameWidth), ('coords', '<i2', (nCoords, ))])
+
+class FGCorpus:
+
+    def __init__(self, corpusFileName, mode='r'):
+        self.fileName = corpusFileName
+        self.mode = mode
+        header = np.fromfile(corpusFileName, dtype=CORPUS_HEADER, count=1)
+        if len(header) == 0 or header[0]['magic'] != b'FRFGC001':
+            raise ValueError("%s is not an FG corpus file." % corpusFileName)
+        self.nCoords = int(header[0]['nCoords'])
+        self.nameWidth = int(header[0]['nameWidth'])
+        self.recordDtype = _recordDtype(self.nameWidth, self.nCoords)
+        self.names = []
+        self.index = {}
+        self.closed = False
+        self._map(int(header[0]['count']))
+
+    # creates an empty corpus file, names longer than nameWidth bytes cannot be stored
+    @classmethod
+    def create(cls, corpusFileName, nameWidth=64, nCoords=FG_NCOORDS):
+        header = np.zeros(1, dtype=CORPUS_HEADER)
+        header[0]['magic'] = b'FRFGC001'
+        header[0]['nCoords'] = nCoords
+        header[0]['nameWidth'] = nameWidth
+        header.tofile(corpusFileName)
+        return cls(corpusFileName, 'r+')
+
+    # packs .fg files into a new corpus, reading chunkSize files at a time
+    @classmethod
+    def fromFG(cls, corpusFileName, FGFileNames, nameWidth=64, chunkSize=10000, threads=None):
+        corpus = cls.create(corpusFileName, nameWidth)
+        FGFileNames = list(FGFileNames)
+        for start in range(0, len(FGFileNames), chunkSize):
+            names, coords = readFGBatch(FGFileNames[start:start + chunkSize], threads)
+            corpus.append(names, coords)
+        return corpus
+
+    # number of records according to the header on disk, which other handles may have updated
+    def _storedCount(self):
+        header = np.fromfile(self.fileName, dtype=CORPUS_HEADER, count=1)
+        return int(header[0]['count'])
+
+    def _checkOpen(self):
+        if self.closed:
+            raise ValueError("Corpus %s is closed." % self.fileName)
+
+    # maps the first count records; only the names of records not seen before are decoded, so
+    # appending in chunks stays linear in the number of faces
+    def _map(self, count):
+        if count > 0:
+            self.records = np.memmap(self.fileName, dtype=self.recordDtype, mode=self.mode,
+                                     offset=CORPUS_HEADER.itemsize, shape=(count, ))
+        else:
+            self.records = np.zeros(0, dtype=self.recordDtype)
+        if count < len(self.names):
+            self.names, self.index = [], {}
+        start = len(self.names)
+        self.names.extend(name.decode('utf-8') for name in self.records['name'][start:])
+        self.index.update((name, row) for row, name in enumerate(self.names[start:], start))
+
+    # (N, nCoords) int16 view on the coordinates of all faces
+    @property
+    def coords(self):
+        self._checkOpen()
+        return self.records['coords']
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    # returns a view on the coordinates of one face, by name or by position
+    def __getitem__(self, key):
+        self._checkOpen()
+        if isinstance(key, str):
+            key = self.index[key]
+        return self.records['coords'][key]
+
+    row = __getitem__
+
+    # appends faces after the records stored in the file (also those appended through other
+    # handles), returns False if nothing could be added
+    def append(self, names, coords):
+        self._checkOpen()
+        if self.mode == 'r':
+            print("Corpus %s was opened read-only." % self.fileName)
+            return False
+        coords = np.asarray(coords)
+        if coords.ndim != 2 or coords.shape[1] != self.nCoords or len(names) != len(coords):
+            print("Expected one name per row of an (N, %i) coordinate matrix." % self.nCoords)
+            return False
+
+        encoded = [name.encode('utf-8') for name in names]
+        tooLong = [name for name in encoded if len(name) > self.nameWidth]
+        if tooLong:
+            print("Names longer than %i bytes cannot be stored: %s" % (self.nameWidth, tooLong[0].decode('utf-8')))
+            return False
+        if isinstance(self.records, np.memmap):
+            self.records.flush()
+        self._map(self._storedCount())
+        duplicates = [name for name in names if name in self.index]
+        if duplicates or len(set(names)) != len(names):
+            print("Face names must be unique in a corpus: %s" % (duplicates[0] if duplicates else 'duplicate in batch'))
+            return False
+
+        records = np.empty(len(names), dtype=self.recordDtype)
+        records['name'] = encoded
+        records['coords'] = np.clip(np.rint(coords), -32768, 32767)
+
+        count = len(self) + len(records)
+        with open(self.fileName, 'r+b') as corpus:
+            corpus.seek(CORPUS_HEADER.itemsize + len(self) * self.recordDtype.itemsize)
+            corpus.write(records.tobytes())
+            corpus.truncate()
+            corpus.seek(CORPUS_HEADER.fields['count'][1])
+            corpus.write(np.array(count, dtype='<u8').tobytes())
+        self._map(count)
+        return True
+
+    # writes faces back to individual .fg files, all faces unless names are given
+    def export(self, directory, names=None, threads=None):
+        os.makedirs(directory, exist_ok=True)
+        names = self.names if names is None else list(names)
+        rows = [self.index[name] for name in names]
+        return writeFGBatch([os.path.join(directory, name + '.fg') for name in names], self.coords[rows], threads)
+
+    # flushes and unmaps the records; the corpus cannot be used afterwards
+    def close(self):
+        if self.closed:
+            return
+        if isinstance(self.records, np.memmap):
+            self.records.flush()
+        self._map(0)
+        self.closed = True
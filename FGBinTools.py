@@ -1,6 +1,62 @@
 # Functions to read and write data from binary FaceGen files - Ron Dotsch (rdotsch@gmail.com)
 
-# VERSION 0.6
+# VERSION 0.20
+
+# Changelog 0.20:
+# - FG_COORD_SCALE (the 1/1000 unit of .fg coordinates) moved here from MeshTools
+
+# Changelog 0.19:
+# - insertOrthogonalSliders skips (and reports) targets that lie in the span of the references
+#   instead of inserting a noise or all-zero slider
+
+# Changelog 0.18:
+# - added decodeFG, decodeFGBatch, encodeFG and encodeFGBatch, the .fg codec on in-memory buffers
+#   (readFGBatch and writeFGBatch are built on them)
+
+# Changelog 0.17:
+# - CtlFile parses the data after the linear controls (tail, see ctlTailDtype) and serializes
+#   back byte-identically (parts, tobytes)
+# - CtlWriter can also delete, replace, rename and reorder sliders and replace the tail
+
+# Changelog 0.16:
+# - added insertOrthogonalSliders, orthogonalizes many sliders against a set of reference sliders
+#   and inserts them all in one write
+
+# Changelog 0.15:
+# - added saveFaces, loadFaces, saveControls and loadControls for binary .npz exports
+
+# Changelog 0.14:
+# - added fileManifest, readManifest, writeManifest and diffManifest for incremental conversions
+
+# Changelog 0.13:
+# - added writeFGBatch and toFGCoords to write many faces from one coordinate matrix
+# - writeFG uses a precompiled struct and pads short coordinate lists correctly (it used to append
+#   a list, and an empty SymTexture reset SymShape instead)
+
+# Changelog 0.12:
+# - added TriFile, memory-maps a .tri mesh as NumPy views with morph targets decoded on access
+# - readTri now returns a TriFile (fixes the per-vertex morph scale that broke reading the end)
+
+# Changelog 0.11:
+# - added EgmFile, memory-maps an .egm file as int16 mode deltas with float32 scales
+# - readEGM is now vectorized on EgmFile, can load a subset of modes and works under Python 3
+
+# Changelog 0.10:
+# - added loadCtl, an LRU cache of parsed control files keyed on path, size and mtime
+#   (see ctlCacheInfo, clearCtlCache); CtlWriter invalidates the files it writes
+# - readCtl, getSliderVector and sliderExists now go through loadCtl
+
+# Changelog 0.9:
+# - added CtlWriter, validates many slider insertions and writes them in one atomic pass
+# - insertSlider and insertOrthogonalSlider now write through CtlWriter
+
+# Changelog 0.8:
+# - added CtlFile, parses a .ctl file once into float32 slider matrices with a label index
+# - readCtl, getSliderVector, sliderExists and findControlByLabel now run on CtlFile (fixes the
+#   str vs bytes header check under Python 3)
+
+# Changelog 0.7:
+# - added readFGBatch and listFG to decode many .fg files into one int16 coordinate matrix
 
 # Changelog 0.6:
 # - added writeFG and _pack
@@ -29,8 +85,36 @@
 
 from struct import *
 from numpy import array
-from LinAlgTools import orthogonalize, normalize
+from concurrent.futures import ThreadPoolExecutor
+from LinAlgTools import orthogonalize, orthogonalizeBatch, normalize
+import numpy as np
 import ctypes
+import csv
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+# fixed header at the start of every .fg file (see readFG)
+FG_HEADER = np.dtype([('magic', 'S8'), ('geomBasisVersion', '<u4'), ('texBasisVersion', '<u4'),
+                      ('SS', '<u4'), ('SA', '<u4'), ('TS', '<u4'), ('TA', '<u4'),
+                      ('zero', '<u4'), ('detailTexFlag', '<u4')])
+
+# coordinate sections of a face, in file order, with the number of coordinates in each
+FG_SECTIONS = (('SS', 50), ('SA', 30), ('TS', 50), ('TA', 0))
+FG_NCOORDS = sum(width for _, width in FG_SECTIONS)
+
+# column ranges of each section within a row of readFGBatch coordinates
+FG_SLICES = {}
+_start = 0
+for _section, _width in FG_SECTIONS:
+    FG_SLICES[_section] = slice(_start, _start + _width)
+    _start += _width
+del _start, _section, _width
+
+# .fg coordinates are stored as int16 multiples of 1/1000
+FG_COORD_SCALE = 1000.0
 
 def _unpack(fmt, binFilePointer):
     return list(unpack_from(fmt, binFilePointer.read(calcsize(fmt))))
@@ -53,268 +137,677 @@ def readFG(FGFileName):
         fgData['TA'] = [i for i in _unpack('<%ih' % TA, fg)]
         return fgData
 
-def writeFG(FGFileName, SymShape = [], ASymShape = [], SymTexture = []):
-    with open(FGFileName, 'wb') as fg:
-        
-        # preamble
-        fmt = '<8s8L130h'
-        values = [b'FRFG0001', 2001060901, 81, 50, 30, 50, 0, 0, 0]
+# returns the paths of all .fg files in a directory, sorted by name
+def listFG(directory):
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.endswith('.fg')]
+
+# Manifests record the (size, mtime) of the source files an output was built from, so tools can
+# tell which sources are new, modified or deleted since the last run. A manifest is a csv of
+# file name, size in bytes and modification time in nanoseconds.
+def fileManifest(fileNames):
+    manifest = {}
+    for fileName in fileNames:
+        stat = os.stat(fileName)
+        manifest[os.path.basename(fileName)] = (stat.st_size, stat.st_mtime_ns)
+    return manifest
+
+def readManifest(manifestFileName):
+    manifest = {}
+    with open(manifestFileName, 'r', newline='') as source:
+        for name, size, mtime in csv.reader(source):
+            manifest[name] = (int(size), int(mtime))
+    return manifest
+
+def writeManifest(manifestFileName, manifest):
+    tempFileName = manifestFileName + '.tmp'
+    with open(tempFileName, 'w', newline='') as out:
+        writer = csv.writer(out)
+        for name in sorted(manifest):
+            writer.writerow([name] + list(manifest[name]))
+    os.replace(tempFileName, manifestFileName)
+
+# compares two manifests, returns the (new, modified, deleted) file names
+def diffManifest(old, new):
+    added = [name for name in new if name not in old]
+    modified = [name for name in new if name in old and old[name] != new[name]]
+    deleted = [name for name in old if name not in new]
+    return added, modified, deleted
+
+# Binary exports of faces and controls as uncompressed .npz archives, an exact (lossless) and much
+# faster alternative to csv for large collections:
+#   faces:    'names' (N,) str, 'coords' (N, 130) int16, 'sections'/'widths' describing the columns
+#   controls: 'labels' (M,) str, 'shape' (M, GS) and 'texture' (M, TS) float32 slider weights
+def saveFaces(fileName, names, coords):
+    np.savez(fileName, kind=np.array('faces'), names=np.asarray(names, dtype=str),
+             coords=np.asarray(coords, dtype=np.int16),
+             sections=np.array([section for section, _ in FG_SECTIONS]),
+             widths=np.array([width for _, width in FG_SECTIONS]))
+
+def loadFaces(fileName):
+    with np.load(fileName, allow_pickle=False) as data:
+        if data['kind'] != 'faces':
+            raise ValueError("%s does not contain faces." % fileName)
+        return data['names'], data['coords']
+
+def saveControls(fileName, labels, shape, texture):
+    np.savez(fileName, kind=np.array('controls'), labels=np.asarray(labels, dtype=str),
+             shape=np.asarray(shape, dtype=np.float32), texture=np.asarray(texture, dtype=np.float32))
+
+def loadControls(fileName):
+    with np.load(fileName, allow_pickle=False) as data:
+        if data['kind'] != 'controls':
+            raise ValueError("%s does not contain controls." % fileName)
+        return data['labels'], data['shape'], data['texture']
+
+def _readFGBytes(FGFileName):
+    with open(FGFileName, 'rb') as fg:
+        return fg.read(FG_HEADER.itemsize + 2 * FG_NCOORDS)
 
-        # fix coordinate values
-        if len(SymShape) == 0:
-            SymShape = 50 * [0]
-        elif len(SymShape) < 50:
-            print("Warning: SymShape should have 50 values, padding with zeros")
-            SymShape.append((50 - len(SymShape)) * [0])
-        elif len(SymShape) > 50:
-            print("Warning: SymShape should have 50 values, cutting values")
-            SymShape = SymShape[:50]
-        
-        if len(ASymShape) == 0:
-            ASymShape = 30 * [0]
-        elif len(ASymShape) < 30:
-            print("Warning: ASymShape should have 30 values, padding with zeros")
-            ASymShape.append((30 - len(ASymShape)) * [0])
-        elif len(ASymShape) > 30:
-            print("Warning: ASymShape should have 30 values, cutting values")
-            ASymShape = ASymShape[:30]
-        
-        if len(SymTexture) == 0:
-            SymShape = 50 * [0]
-        elif len(SymTexture) < 50:
-            print("Warning: SymTexture should have 50 values, padding with zeros")
-            SymTexture.append((50 - len(SymTexture)) * [0])
-        elif len(SymTexture) > 50:
-            print("Warning: SymTexture should have 50 values, cutting values")
-            SymTexture = SymTexture[:50]
-
-        # append coordinate
-        values.extend(SymShape + ASymShape + SymTexture)    
-
-        # write to file
-        _pack(fmt, fg, values)
-
-
-def readEGM(egmFileName):
-    with open(egmFileName, 'rb') as egm:
-        egmData = {'S':[], 'A':[]}
-        (dummy, V, S, A, geomBasisVersion, reserved) = _unpack('<8s4L40s', egm)
-        if not dummy == 'FREGM002':
-            print("Not a valid .EGM file.")
-            return False
+# decodes one .fg buffer into a preallocated row, returns False if the buffer is not a valid face
+def _decodeFGInto(buf, row):
+    if len(buf) < FG_HEADER.itemsize:
+        return False
+    header = np.frombuffer(buf, dtype=FG_HEADER, count=1)[0]
+    if header['magic'] != b'FRFG0001':
+        return False
 
-        for mode in range(S):
-            (scale, ) = _unpack('<f', egm)
-            egmData['S'].append([])
-            for vertex in range(V):
-                egmData['S'][mode].append([scale * i for i in _unpack('<3h', egm)])
+    counts = [int(header[section]) for section, _ in FG_SECTIONS]
+    if len(buf) < FG_HEADER.itemsize + 2 * sum(counts):
+        return False
 
-        
+    values = np.frombuffer(buf, dtype='<i2', count=sum(counts), offset=FG_HEADER.itemsize)
+    row[:] = 0
+    start = 0
+    for (section, width), count in zip(FG_SECTIONS, counts):
+        n = min(width, count)
+        row[FG_SLICES[section].start:FG_SLICES[section].start + n] = values[start:start + n]
+        start += count
+    return True
 
-        for mode in range(A):
-            (scale, ) = _unpack('<f', egm)
-            egmData['A'].append([])
-            for vertex in range(V):
-                egmData['A'][mode].append([scale * i for i in _unpack('<3h', egm)])
+# decodes the contents of one .fg file (bytes, bytearray or memoryview) into a (130, ) int16
+# row of SS | SA | TS | TA coordinates, returns None if the buffer is not a valid face
+def decodeFG(buf):
+    row = np.zeros(FG_NCOORDS, dtype=np.int16)
+    if not _decodeFGInto(buf, row):
+        return None
+    return row
+
+# decodes many .fg buffers into an (N, 130) int16 matrix; returns (names, coords) with the
+# names of the valid buffers, invalid ones are reported and left out
+def decodeFGBatch(names, buffers):
+    names = list(names)
+    coords = np.zeros((len(names), FG_NCOORDS), dtype=np.int16)
+    valid = []
+    for name, buf in zip(names, buffers):
+        if not _decodeFGInto(buf, coords[len(valid)]):
+            print("Not a valid .FG file: %s" % name)
+            continue
+        valid.append(name)
+    return np.array(valid, dtype=str), coords[:len(valid)]
+
+# reads many .fg files into an (N, 130) int16 matrix of SS | SA | TS | TA coordinates,
+# returns (names, coords) where names are the file names without the .fg extension.
+# Invalid files are reported and left out. threads > 1 reads the files through a thread pool.
+def readFGBatch(FGFileNames, threads=None):
+    FGFileNames = list(FGFileNames)
+    if threads and threads > 1:
+        with ThreadPoolExecutor(threads) as pool:
+            names, coords = decodeFGBatch(FGFileNames, pool.map(_readFGBytes, FGFileNames))
+    else:
+        names, coords = decodeFGBatch(FGFileNames, map(_readFGBytes, FGFileNames))
+    return np.array([os.path.splitext(os.path.basename(name))[0] for name in names], dtype=str), coords
+
+# header values written by writeFG and writeFGBatch
+FG_PREAMBLE = (b'FRFG0001', 2001060901, 81, 50, 30, 50, 0, 0, 0)
+_FG_STRUCT = Struct('<8s8L%ih' % FG_NCOORDS)
+
+# one complete .fg file as written by writeFG
+FG_RECORD = np.dtype([('header', FG_HEADER), ('coords', '<i2', (FG_NCOORDS, ))])
+
+def _fitCoords(values, width, name):
+    values = list(values)
+    if len(values) == 0:
+        values = width * [0]
+    elif len(values) < width:
+        print("Warning: %s should have %i values, padding with zeros" % (name, width))
+        values = values + (width - len(values)) * [0]
+    elif len(values) > width:
+        print("Warning: %s should have %i values, cutting values" % (name, width))
+        values = values[:width]
+    return values
 
-    return egmData
-    
-def readTri(triFileName):
-    with open(triFileName, 'rb') as tri:
-        triData = {'vert':[], 'tri':[], 'quad':[], 'vlabels':[], 'slabels':[], 'tex':[], 'ttInd':[], 'qtInd':[], 'morphs':[]}
-        
-        (dummy, V, T, Q, LV, LS, X, ext, Md, Ms, K, reserved) = _unpack('<8s10I16s', tri)
-        for i in range(V + K):
-            triData['vert'].append(_unpack('3f', tri))
-        for i in range(T):
-            triData['tri'].append(_unpack('<3i', tri))
-        for i in range(Q):
-            triData['quad'].append(_unpack('<4i', tri))
-        for i in range(LV):
-            (vlabels, S) = _unpack('<2i', tri)
-            string  = _unpack('<%is' % S, tri)
-            triData['vlabels'].append((vlabels, string))
-        for i in range(LS):
-            slabels = _unpack('<i3fi', tri)
-            S = slabels.pop()
-            string = _unpack('<%is' % S, tri)
-            triData['slabels'].append((slabels, string))
-        
-        if X == 0 and (ext & 0x01):
-            for i in range(V):
-                triData['tex'].append(_unpack('2f', tri))
-        elif X > 0 and (ext & 0x01):
-            for i in range(X):
-                triData['tex'].append(_unpack('2f', tri))
-            for i in range(T):
-                triData['ttInd'].append(_unpack('<3i', tri))
-            for i in range(Q):
-                triData['qtInd'].append(_unpack('<4i', tri))
+def writeFG(FGFileName, SymShape = [], ASymShape = [], SymTexture = []):
+    with open(FGFileName, 'wb') as fg:
         
-        for i in range(Md):
-            N = _unpack('<i', tri)[0]
-            (label) = _unpack('%is' % N, tri)
-            print(label)
-            #print (label, scale)
-            deltas = []
-            for j in range(V):
-                deltas.append(_unpack('<f3h' , tri))
-            triData['morphs'].append((label, deltas))
-    
-    return triData
+        # fix coordinate values
+        SymShape = _fitCoords(SymShape, 50, 'SymShape')
+        ASymShape = _fitCoords(ASymShape, 30, 'ASymShape')
+        SymTexture = _fitCoords(SymTexture, 50, 'SymTexture')
+
+        # write preamble and coordinates to file
+        fg.write(_FG_STRUCT.pack(*FG_PREAMBLE, *(SymShape + ASymShape + SymTexture)))
+
+# converts (N, 100) SS | TS or (N, 130) SS | SA | TS coordinates into (N, 130) int16 rows,
+# rounding and clipping to the int16 range; returns False for any other shape
+def toFGCoords(coords):
+    coords = np.asarray(coords)
+    if coords.ndim != 2 or coords.shape[1] not in (100, FG_NCOORDS):
+        print("Coordinates should have 100 (SS, TS) or 130 (SS, SA, TS) columns.")
+        return False
 
+    if coords.dtype.kind == 'f':
+        coords = np.rint(coords)
+    clipped = (coords < -32768) | (coords > 32767)
+    if clipped.any():
+        print("Warning: %i coordinate values outside the int16 range, clipping values" % clipped.sum())
+        coords = np.clip(coords, -32768, 32767)
+
+    if coords.shape[1] == FG_NCOORDS:
+        return coords.astype(np.int16)
+    out = np.zeros((len(coords), FG_NCOORDS), dtype=np.int16)
+    out[:, FG_SLICES['SS']] = coords[:, :50]
+    out[:, FG_SLICES['TS']] = coords[:, 50:]
+    return out
+
+# encodes (N, 100) or (N, 130) coordinates (see toFGCoords) as the contents of N .fg files;
+# returns a list of N memoryviews on one buffer, or False
+def encodeFGBatch(coords):
+    coords = toFGCoords(coords)
+    if coords is False:
+        return False
+    records = np.empty(len(coords), dtype=FG_RECORD)
+    records['header'] = np.array(FG_PREAMBLE, dtype=FG_HEADER)
+    records['coords'] = coords
+    data = memoryview(records.tobytes())
+    return [data[i * FG_RECORD.itemsize:(i + 1) * FG_RECORD.itemsize] for i in range(len(coords))]
+
+# encodes one face, (100, ) SS | TS or (130, ) SS | SA | TS coordinates, as .fg file contents
+def encodeFG(coords):
+    encoded = encodeFGBatch(np.asarray(coords)[np.newaxis])
+    if encoded is False:
+        return False
+    return encoded[0].tobytes()
+
+# writes one .fg file per row of an (N, 100) or (N, 130) coordinate matrix (see toFGCoords);
+# all files are serialized at once and written through a thread pool when threads > 1
+def writeFGBatch(FGFileNames, coords, threads=None):
+    FGFileNames = list(FGFileNames)
+    if len(FGFileNames) != len(coords):
+        print("Expected one file name per row of coordinates.")
+        return False
+    data = encodeFGBatch(coords)
+    if data is False:
+        return False
 
-def insertSlider(sliderLabel, vectorAsList, sliderType, ctlFile):
-    # read and remember until appropriate sliderType
-    print("Writing slider {} to .ctl file {}".format(sliderLabel, ctlFile))
-    with open(ctlFile, 'rb') as ctl:
-        ctlData = {}
-        
-        out = ""
-        
-        (dummy, geometryBasisVersion, textureBasisVersion, nGS, nGA, nTS, nTA, nLGS) = _unpack('<8s7L', ctl)
+    def write(i):
+        with open(FGFileNames[i], 'wb') as fg:
+            fg.write(data[i])
 
-        if dummy != b'FRCTL001':
-            print("File is not a FaceGen binary .ctl file.")
-            return False
+    if threads and threads > 1:
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(write, range(len(FGFileNames))))
+    else:
+        for i in range(len(FGFileNames)):
+            write(i)
+    return True
 
-        out = pack('<8s6L', dummy, geometryBasisVersion, textureBasisVersion, nGS, nGA, nTS, nTA)
 
-        if sliderType == 'SS':
-            if len(vectorAsList) != nGS:
-                print("Number of weights incorrect for slider type.")
-                return False
-            out += pack('<L', nLGS + 1)
-            for weight in vectorAsList:
-                out += pack('<f', weight)
-            out += pack('<L%is' % len(sliderLabel), len(sliderLabel), bytes(sliderLabel, 'utf-8'))
-        else:
-            out += pack('<L', nLGS)
+# fixed header at the start of every .egm file
+EGM_HEADER = np.dtype([('magic', 'S8'), ('V', '<u4'), ('S', '<u4'), ('A', '<u4'),
+                       ('geomBasisVersion', '<u4'), ('reserved', 'S40')])
 
-        for _ in range(nLGS):
-            out += ctl.read(calcsize('%if' % nGS))  # weights
-            (labelLength, ) = _unpack('<L', ctl)
-            out += pack('<L', labelLength)
-            out += ctl.read(calcsize('%is' % labelLength))
+# Memory-mapped .egm file. deltas['S'] and deltas['A'] are (modes, V, 3) int16 views on the
+# quantized symmetric and asymmetric mode deltas, scales[...] the float32 scale of each mode.
+# Nothing is dequantized until modes() is called.
+class EgmFile:
 
-        (nLGA, ) = _unpack('<I', ctl)
+    def __init__(self, egmFileName):
+        header = np.fromfile(egmFileName, dtype=EGM_HEADER, count=1)
+        if len(header) == 0 or header[0]['magic'] != b'FREGM002':
+            raise ValueError("Not a valid .EGM file.")
+        self.fileName = egmFileName
+        self.V, self.S, self.A = int(header[0]['V']), int(header[0]['S']), int(header[0]['A'])
+        self.geomBasisVersion = int(header[0]['geomBasisVersion'])
 
-        if sliderType == 'SA':
-            if len(vectorAsList) != nGA:
-                print("Number of weights incorrect for slider type.")
-                return False
-            out += pack('<L', nLGA + 1)
-            for weight in vectorAsList:
-                out += pack('<f', weight)
-            out += pack('<L%is' % len(sliderLabel), len(sliderLabel), bytes(sliderLabel, 'utf-8'))
+        modeDtype = np.dtype([('scale', '<f4'), ('deltas', '<i2', (self.V, 3))])
+        if self.S + self.A > 0:
+            records = np.memmap(egmFileName, dtype=modeDtype, mode='r', offset=EGM_HEADER.itemsize,
+                                shape=(self.S + self.A, ))
         else:
-            out += pack('<L', nLGA)
+            records = np.zeros(0, dtype=modeDtype)
+
+        self.deltas = {'S': records['deltas'][:self.S], 'A': records['deltas'][self.S:]}
+        self.scales = {'S': np.array(records['scale'][:self.S], dtype=np.float32),
+                       'A': np.array(records['scale'][self.S:], dtype=np.float32)}
+
+    # dequantized (modes, V, 3) float32 deltas of a section, for all modes or the given mode indices
+    def modes(self, section='S', modes=None):
+        deltas, scales = self.deltas[section], self.scales[section]
+        if modes is not None:
+            deltas, scales = deltas[modes], scales[modes]
+        return deltas * scales[:, None, None]
+
+# returns {'S': (S, V, 3), 'A': (A, V, 3)} float32 mode deltas, optionally for a subset of modes
+def readEGM(egmFileName, symModes=None, asymModes=None):
+    try:
+        egm = EgmFile(egmFileName)
+    except ValueError as e:
+        print(e)
+        return False
 
-        for _ in range(nLGA):
-            out += ctl.read(calcsize('%if' % nGA))  # weights
-            (labelLength, ) = _unpack('<L', ctl)
-            out += pack('<L', labelLength)
-            out += ctl.read(calcsize('%is' % labelLength))  # label string
+    return {'S': egm.modes('S', symModes), 'A': egm.modes('A', asymModes)}
+    
+# fixed header at the start of every .tri file
+TRI_HEADER = np.dtype([('magic', 'S8'), ('V', '<i4'), ('T', '<i4'), ('Q', '<i4'), ('LV', '<i4'), ('LS', '<i4'),
+                       ('X', '<i4'), ('ext', '<i4'), ('Md', '<i4'), ('Ms', '<i4'), ('K', '<i4'), ('reserved', 'S16')])
+
+# Memory-mapped .tri mesh. vert is a (V+K, 3) float32 view, tri (T, 3) and quad (Q, 4) int32
+# views, tex the (X or V, 2) float32 texture coordinates with ttInd/qtInd their per-facet indices
+# (empty when the file has none). Morph targets are indexed by label on opening and only decoded
+# by morph().
+class TriFile:
+
+    def __init__(self, triFileName):
+        header = np.fromfile(triFileName, dtype=TRI_HEADER, count=1)
+        if len(header) == 0 or header[0]['magic'] != b'FRTRI003':
+            raise ValueError("Not a valid .TRI file.")
+        self.fileName = triFileName
+        (self.V, self.T, self.Q, LV, LS, X, ext, Md, Ms, self.K) = [int(header[0][field]) for field in TRI_HEADER.names[1:11]]
+
+        self.buffer = np.memmap(triFileName, dtype=np.uint8, mode='r')
+        self._offset = TRI_HEADER.itemsize
+
+        self.vert = self._view('<f4', (self.V + self.K, 3))
+        self.tri = self._view('<i4', (self.T, 3))
+        self.quad = self._view('<i4', (self.Q, 4))
+
+        self.vlabels = []
+        for _ in range(LV):
+            (vertex, ) = self._unpack('<i')
+            self.vlabels.append((vertex, self._label()))
+        self.slabels = []
+        for _ in range(LS):
+            (triangle, x, y, z) = self._unpack('<i3f')
+            self.slabels.append(((triangle, x, y, z), self._label()))
+
+        self.tex = np.zeros((0, 2), dtype=np.float32)
+        self.ttInd = np.zeros((0, 3), dtype=np.int32)
+        self.qtInd = np.zeros((0, 4), dtype=np.int32)
+        if ext & 0x01:
+            if X == 0:
+                self.tex = self._view('<f4', (self.V, 2))
+            else:
+                self.tex = self._view('<f4', (X, 2))
+                self.ttInd = self._view('<i4', (self.T, 3))
+                self.qtInd = self._view('<i4', (self.Q, 4))
+
+        # remember where each morph starts, decoding happens in morph()
+        self.morphs = OrderedDict()
+        for _ in range(Md):
+            label = self._label()
+            self.morphs[label] = ('diff', self._offset)
+            self._offset += 4 + 6 * self.V
+        target = self.V
+        for _ in range(Ms):
+            label = self._label()
+            (N, ) = self._unpack('<i')
+            self.morphs[label] = ('stat', self._offset, N, target)
+            self._offset += 4 * N
+            target += N
+
+    def _view(self, dtype, shape):
+        count = int(np.prod(shape))
+        view = np.frombuffer(self.buffer, dtype=dtype, count=count, offset=self._offset).reshape(shape)
+        self._offset += view.nbytes
+        return view
+
+    def _unpack(self, fmt):
+        values = unpack_from(fmt, self.buffer, self._offset)
+        self._offset += calcsize(fmt)
+        return values
+
+    def _label(self):
+        (length, ) = self._unpack('<i')
+        label = bytes(self.buffer[self._offset:self._offset + length]).rstrip(b'\x00').decode('utf-8', 'surrogateescape')
+        self._offset += length
+        return label
+
+    @property
+    def morphLabels(self):
+        return list(self.morphs)
+
+    # returns the (V, 3) float32 vertex deltas of a morph target
+    def morph(self, label):
+        kind, offset = self.morphs[label][:2]
+        if kind == 'diff':
+            (scale, ) = unpack_from('<f', self.buffer, offset)
+            deltas = np.frombuffer(self.buffer, dtype='<i2', count=3 * self.V, offset=offset + 4)
+            return deltas.reshape(self.V, 3) * np.float32(scale)
+
+        (N, target) = self.morphs[label][2:]
+        indices = np.frombuffer(self.buffer, dtype='<i4', count=N, offset=offset)
+        deltas = np.zeros((self.V, 3), dtype=np.float32)
+        deltas[indices] = self.vert[target:target + N] - self.vert[indices]
+        return deltas
 
-        (nLTS, ) = _unpack('<I', ctl)
+def readTri(triFileName):
+    try:
+        return TriFile(triFileName)
+    except ValueError as e:
+        print(e)
+        return False
 
-        if sliderType == 'TS':
-            if len(vectorAsList) != nTS:
-                print("Number of weights incorrect for slider type.")
-                return False
-            out += pack('<L', nLTS + 1)
-            for weight in vectorAsList:
-                out += pack('<f', weight)
-            out += pack('<L%is' % len(sliderLabel), len(sliderLabel), bytes(sliderLabel, 'utf-8'))
-        else:
-            out += pack('<L', nLTS)
 
-        for _ in range(nLTS):
-            out += ctl.read(calcsize('%if' % nTS))  # weights
-            (labelLength, ) = _unpack('<L', ctl)
-            out += pack('<L', labelLength)
-            out += ctl.read(calcsize('%is' % labelLength))  # label string
+def insertSlider(sliderLabel, vectorAsList, sliderType, ctlFile):
+    print("Writing slider {} to .ctl file {}".format(sliderLabel, ctlFile))
+    writer = CtlWriter(ctlFile)
+    writer.add(sliderLabel, vectorAsList, sliderType)
+    return writer.commit()
 
-        (nLTA, ) = _unpack('<I', ctl)
+    
+# linear control sections of a .ctl file, in file order
+CTL_SECTIONS = ('GS', 'GA', 'TS', 'TA')
+
+# Layout of the data after the linear control sections. It has no counts of its own, the sizes
+# follow from the GS and TS coordinate counts; the layout was worked out from si.ctl:
+#   offsetLinear   5 groups of 4 offset linear controls (coefficients + offset), the age
+#                  (offsets about 30) and gender controls of the shape and texture coordinates
+#   pairs          20 offset linear controls over GS | TS; they come in pairs with opposite
+#                  offsets (the 5 x 4 ordered pairs of the groups above)
+#   groupMaps      5 records of a GS | TS vector followed by 15000 further values
+# The names describe the structure only. A file whose tail does not have this size keeps its
+# tail as raw bytes.
+def ctlTailDtype(nGS, nTS):
+    def offsetLinear(n):
+        return [('coeffs', '<f4', (n, )), ('offset', '<f4')]
+    return np.dtype([
+        ('offsetLinear', [('shapeAge', offsetLinear(nGS)), ('textureAge', offsetLinear(nTS)),
+                          ('shapeGender', offsetLinear(nGS)), ('textureGender', offsetLinear(nTS))], (5, )),
+        ('pairs', offsetLinear(nGS + nTS), (20, )),
+        ('groupMaps', [('vector', '<f4', (nGS + nTS, )), ('values', '<f4', (15000, ))], (5, )),
+    ])
+
+# maps the FG coordinate names used elsewhere (SS, SA) onto the .ctl section names (GS, GA)
+def _ctlSection(sliderType):
+    if sliderType[0] == "S":
+        sliderType = "G" + sliderType[1]
+    return sliderType
+
+# Parsed .ctl file. The file is read once into a buffer and every linear control section
+# is exposed as a float32 (n_sliders, n_coords) matrix in sections[...], with labels[...]
+# listing the slider labels in file order and index[...] mapping a label to its row.
+# spans[...] holds the (start, end) byte range of each section's slider records, offsets[...]
+# the start of every record (and the section end), and end the offset of the data following
+# the linear controls. tail is a read-only structured view of that data (see ctlTailDtype),
+# or None if it does not have the expected size; tailBytes always holds it as raw bytes.
+class CtlFile:
+
+    def __init__(self, ctlFileName=None, buf=None):
+        if buf is None:
+            with open(ctlFileName, 'rb') as ctl:
+                buf = ctl.read()
+        self.fileName = ctlFileName
+        self.buffer = buf
+
+        (dummy, self.geometryBasisVersion, self.textureBasisVersion, nGS, nGA, nTS, nTA) = unpack_from('<8s6L', buf, 0)
+        if dummy != b'FRCTL001':
+            raise ValueError("File is not a FaceGen binary .ctl file.")
+
+        self.nCoords = dict(zip(CTL_SECTIONS, (nGS, nGA, nTS, nTA)))
+        self.sections, self.labels, self.index, self.spans, self.offsets = {}, {}, {}, {}, {}
+
+        data = np.frombuffer(buf, dtype=np.uint8)
+        offset = calcsize('<8s6L')
+        for section in CTL_SECTIONS:
+            nCoords = self.nCoords[section]
+            (nSliders, ) = unpack_from('<L', buf, offset)
+            offset += 4
+            start = offset
+
+            # walk the variable-length labels once, remembering where each weight vector starts
+            weightOffsets = np.empty(nSliders, dtype=np.int64)
+            labels = []
+            for i in range(nSliders):
+                weightOffsets[i] = offset
+                offset += 4 * nCoords
+                (labelLength, ) = unpack_from('<L', buf, offset)
+                labels.append(buf[offset + 4:offset + 4 + labelLength].decode('utf-8', 'surrogateescape'))
+                offset += 4 + labelLength
+
+            # labels interleave the weights, so gather all weight bytes into one contiguous matrix
+            weights = data[weightOffsets[:, None] + np.arange(4 * nCoords)]
+            self.sections[section] = weights.view('<f4').reshape(nSliders, nCoords)
+            self.sections[section].flags.writeable = False
+            self.labels[section] = labels
+            self.index[section] = {}
+            for row, label in enumerate(labels):
+                self.index[section].setdefault(label, row)
+            self.spans[section] = (start, offset)
+            self.offsets[section] = np.append(weightOffsets, offset)
+
+        self.end = offset
+        self.tailBytes = memoryview(buf)[offset:]
+        tailDtype = ctlTailDtype(nGS, nTS)
+        self.tail = None
+        if len(self.tailBytes) == tailDtype.itemsize:
+            self.tail = np.frombuffer(buf, dtype=tailDtype, count=1, offset=offset)[0]
+
+    # memoryview of the complete record (weights, label length and label) of row i of a section
+    def record(self, section, i):
+        return memoryview(self.buffer)[self.offsets[section][i]:self.offsets[section][i + 1]]
+
+    # the file as a list of buffers (views on this file's buffer where nothing changed);
+    # records[section] optionally replaces a section's records with a list of record buffers
+    def parts(self, records=None, tail=None):
+        records = records or {}
+        buf = memoryview(self.buffer)
+        parts = [buf[:calcsize('<8s6L')]]
+        for section in CTL_SECTIONS:
+            (start, end) = self.spans[section]
+            if section in records:
+                parts.append(pack('<L', len(records[section])))
+                parts.extend(records[section])
+            else:
+                parts.append(buf[start - 4:end])
+        parts.append(self.tailBytes if tail is None else tail)
+        return parts
+
+    # serializes the file; without changes the result is identical to the file read
+    def tobytes(self):
+        return b''.join(self.parts())
+
+    # returns the weights of a slider as a float32 row, or None if there is no such slider
+    def slider(self, label, sliderType='GS'):
+        sliderType = _ctlSection(sliderType)
+        row = self.index[sliderType].get(label)
+        if row is None:
+            return None
+        return self.sections[sliderType][row]
+
+    def has(self, label, sliderType='GS'):
+        return label in self.index[_ctlSection(sliderType)]
+
+# parsed control files shared by loadCtl, most recently used last
+CTL_CACHE_SIZE = 16
+_ctlCache = OrderedDict()
+_ctlCacheStats = {'hits': 0, 'misses': 0}
+_ctlCacheLock = threading.Lock()
+
+# returns the parsed CtlFile for a control file, reusing an earlier parse as long as the
+# file's size and modification time are unchanged
+def loadCtl(ctlFileName):
+    path = os.path.abspath(ctlFileName)
+    stat = os.stat(path)
+    key = (stat.st_size, stat.st_mtime_ns)
+    with _ctlCacheLock:
+        cached = _ctlCache.get(path)
+        if cached is not None and cached[0] == key:
+            _ctlCache.move_to_end(path)
+            _ctlCacheStats['hits'] += 1
+            return cached[1]
+        _ctlCacheStats['misses'] += 1
+
+    ctl = CtlFile(path)
+    with _ctlCacheLock:
+        _ctlCache[path] = (key, ctl)
+        _ctlCache.move_to_end(path)
+        while len(_ctlCache) > CTL_CACHE_SIZE:
+            _ctlCache.popitem(last=False)
+    return ctl
+
+def invalidateCtl(ctlFileName):
+    with _ctlCacheLock:
+        _ctlCache.pop(os.path.abspath(ctlFileName), None)
+
+def clearCtlCache():
+    with _ctlCacheLock:
+        _ctlCache.clear()
+        _ctlCacheStats['hits'] = _ctlCacheStats['misses'] = 0
+
+def ctlCacheInfo():
+    with _ctlCacheLock:
+        return dict(_ctlCacheStats, size=len(_ctlCache), maxsize=CTL_CACHE_SIZE)
+
+# Collects edits of a .ctl file and writes them all in one pass. As with insertSlider, new
+# sliders are placed at the start of their section (in the order added); delete, replace,
+# reorder and rename act on the first slider with a label, as it is after the earlier edits.
+# setTail replaces the data after the linear controls (raw bytes or a ctlTailDtype record).
+# commit() applies and validates every edit before anything is written, then streams the new
+# file into a temporary file next to the original and renames it over the original. Records
+# that did not change are written straight from the original file's buffer.
+class CtlWriter:
+
+    def __init__(self, ctlFileName):
+        self.fileName = ctlFileName
+        self.edits = []
+        self.tail = None
+
+    def add(self, label, vector, sliderType='SS'):
+        self.edits.append(('add', _ctlSection(sliderType), label, vector))
+
+    def delete(self, label, sliderType='SS'):
+        self.edits.append(('delete', _ctlSection(sliderType), label, None))
+
+    def replace(self, label, vector, sliderType='SS'):
+        self.edits.append(('replace', _ctlSection(sliderType), label, vector))
+
+    def rename(self, label, newLabel, sliderType='SS'):
+        self.edits.append(('rename', _ctlSection(sliderType), label, newLabel))
+
+    # moves the given sliders to the start of their section in this order, the others follow
+    # in their current order (a label listed k times moves the first k sliders with that label)
+    def reorder(self, labels, sliderType='SS'):
+        self.edits.append(('reorder', _ctlSection(sliderType), list(labels), None))
+
+    def setTail(self, tail):
+        self.tail = tail
+
+    def __len__(self):
+        return len(self.edits) + (self.tail is not None)
+
+    def _record(self, ctl, section, label, vector):
+        weights = np.asarray(vector, dtype='<f4')
+        if weights.shape != (ctl.nCoords[section], ):
+            print("Number of weights incorrect for slider type (%s, %s)." % (label, section))
+            return None
+        labelBytes = label.encode('utf-8', 'surrogateescape')
+        return weights.tobytes() + pack('<L', len(labelBytes)) + labelBytes
+
+    def commit(self):
+        try:
+            ctl = loadCtl(self.fileName)
+        except ValueError as e:
+            print(e)
+            return False
 
-        if sliderType == 'TA':
-            if len(vectorAsList) != nTA:
-                print("Number of weights incorrect for slider type.")
+        # every section is a list of [label, record buffer, added] entries
+        entries = {}
+        for (edit, section, label, value) in self.edits:
+            if section not in entries:
+                entries[section] = [[name, ctl.record(section, i), False] for i, name in enumerate(ctl.labels[section])]
+            rows = entries[section]
+            labels = [entry[0] for entry in rows]
+            if edit == 'reorder':
+                # a label listed k times moves the first k sliders with that label
+                first, taken = [], set()
+                for name in label:
+                    row = next((i for i, entry in enumerate(rows) if entry[0] == name and i not in taken), None)
+                    if row is None:
+                        print("Slider %s not found in %s (%s)." % (name, self.fileName, section))
+                        return False
+                    taken.add(row)
+                    first.append(rows[row])
+                rows[:] = first + [entry for i, entry in enumerate(rows) if i not in taken]
+                continue
+            if edit == 'add':
+                record = self._record(ctl, section, label, value)
+                if record is None:
+                    return False
+                position = next((i for i, entry in enumerate(rows) if not entry[2]), len(rows))
+                rows.insert(position, [label, record, True])
+                continue
+            if label not in labels:
+                print("Slider %s not found in %s (%s)." % (label, self.fileName, section))
                 return False
-            out += pack('<L', nLTA + 1)
-            for weight in vectorAsList:
-                out += pack('<f', weight)
-            out += pack('<L%is' % len(sliderLabel), len(sliderLabel), bytes(sliderLabel, 'utf-8'))
-        else:
-            out += pack('<L', nLTA)
-
-        for _ in range(nLTA):
-            out += ctl.read(calcsize('%if' % nTA))  # weights
-            (labelLength, ) = _unpack('<L', ctl)
-            out += pack('<L', labelLength)
-            out += ctl.read(calcsize('%is' % labelLength))  # label string
-
-        out += ctl.read()
-
-    with open(ctlFile, 'wb') as ctl:
-        ctl.write(out)
+            row = labels.index(label)
+            if edit == 'delete':
+                del rows[row]
+            elif edit == 'replace':
+                record = self._record(ctl, section, label, value)
+                if record is None:
+                    return False
+                rows[row][1] = record
+            elif edit == 'rename':
+                weights = bytes(rows[row][1][:4 * ctl.nCoords[section]])
+                newBytes = value.encode('utf-8', 'surrogateescape')
+                rows[row][:2] = [value, weights + pack('<L', len(newBytes)) + newBytes]
+
+        tail = self.tail
+        if tail is not None and not isinstance(tail, (bytes, bytearray, memoryview)):
+            tail = np.asarray(tail).tobytes()
+        records = {section: [entry[1] for entry in rows] for section, rows in entries.items()}
+        _writeAtomic(self.fileName, ctl.parts(records, tail))
+        invalidateCtl(self.fileName)
+        self.edits = []
+        self.tail = None
+        return True
 
-    return True
+# writes a list of buffers to a temporary file in the target directory, then renames it over fileName
+def _writeAtomic(fileName, parts):
+    directory = os.path.dirname(os.path.abspath(fileName))
+    fd, tempFileName = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(fileName), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.writelines(parts)
+            out.flush()
+            os.fsync(out.fileno())
+        if os.path.exists(fileName):
+            shutil.copymode(fileName, tempFileName)
+        os.replace(tempFileName, fileName)
+    except BaseException:
+        if os.path.exists(tempFileName):
+            os.remove(tempFileName)
+        raise
 
-    
 def readCtl(ctlFile):
-    # read and remember until appropriate sliderType
-    with open(ctlFile, 'rb') as ctl:
-        data = {'GS':[], 'GA':[], 'TS':[], 'TA':[]}
-
-        (dummy, geometryBasisVersion, textureBasisVersion, nGS, nGA, nTS, nTA, nLGS) = _unpack ('<8s7L', ctl)
-
-        if not dummy == 'FRCTL001':
-            print("File is not a FaceGen binary .ctl file.")
-            return False
-
-        for i in range(nLGS):
-            weights = _unpack('%if' % (nGS), ctl) 
-            (labelLength, ) = _unpack('<L', ctl)
-            (label, ) = _unpack('%is' % (labelLength), ctl)
-            data['GS'].append((label, weights))
-
-        (nLGA, ) = _unpack('<I', ctl)
-        for i in range(nLGA):
-            weights = _unpack('%if' % (nGA), ctl) 
-            (labelLength, ) = _unpack('<L', ctl)
-            (label, ) = _unpack('%is' % (labelLength), ctl)
-            data['GA'].append((label, weights))
-
-        (nLTS, ) = _unpack('<I', ctl)
-        for i in range(nLTS):
-            weights = _unpack('%if' % (nTS), ctl) 
-            (labelLength, ) = _unpack('<L', ctl)
-            (label, ) = _unpack('%is' % (labelLength), ctl)
-            data['TS'].append((label, weights))
-
-        (nLTA, ) = _unpack('<I', ctl)
-        for i in range(nLTA):
-            weights = _unpack('%if' % (nTA), ctl) 
-            (labelLength, ) = _unpack('<L', ctl)
-            (label, ) = _unpack('%is' % (labelLength), ctl)
-            data['TA'].append((label, weights))
+    try:
+        ctl = loadCtl(ctlFile)
+    except ValueError as e:
+        print(e)
+        return False
 
+    data = {}
+    for section in CTL_SECTIONS:
+        data[section] = list(zip(ctl.labels[section], ctl.sections[section].tolist()))
     return data
 
 def getSliderVector(ctlFileName, label, sliderType = 'SS'):
-    if sliderType[0] == "S":
-        sliderType = "G" + sliderType[1]
-    ctl = readCtl(ctlFileName)[sliderType]
-    for ctlLabel, weights in ctl:
-        if ctlLabel == label:
-            return array(weights)
+    weights = loadCtl(ctlFileName).slider(label, sliderType)
+    if weights is not None:
+        return array(weights, dtype=float)
 
 def sliderExists(ctlFileName, label, sliderType = 'SS'):
-    if getSliderVector(ctlFileName, label , sliderType) == None:
-        return False
-    else:
-        return True
+    return loadCtl(ctlFileName).has(label, sliderType)
 
 
 def readCtlOld(ctlFileName):
@@ -402,20 +895,61 @@ def insertOrthogonalSlider (ctlfile, vec1label, vec2label, newlabel = False):
     else:
         label = "%s orthogonal to %s (%.4f * %s + %.4f * %s)" % (vec2label, vec1label, weights[0], vec1label, weights[1], vec2label)
         
-    if not getSliderVector(ctlfile, label) == None:
+    if sliderExists(ctlfile, label):
         print("Slider %s already exists in control file (%s)." % (label, ctlfile))
     else:
-        if insertSlider(label, orthovec.tolist(), 'SS', ctlfile):
+        writer = CtlWriter(ctlfile)
+        writer.add(label, orthovec, 'SS')
+        if writer.commit():
             print (label, "added to control file:", ctlfile)
         else:
             print (label, "NOT added to control file:", ctlfile)
 
+# Orthogonalizes every target slider against all reference sliders (see orthogonalizeBatch) and
+# inserts the results in one write. Labels default to "<target> orthogonal to <references>".
+# Targets that lie (nearly) in the span of the references are reported and not inserted.
+# Returns the (M, K + 1) mixing weights of [references..., target] (NaN for skipped targets), or False.
+def insertOrthogonalSliders(ctlfile, targetLabels, referenceLabels, sliderType = 'SS', newLabels = None):
+    ctl = loadCtl(ctlfile)
+    missing = [label for label in list(targetLabels) + list(referenceLabels) if not ctl.has(label, sliderType)]
+    if missing:
+        print("Sliders not found in control file (%s): %s" % (ctlfile, ', '.join(missing)))
+        return False
+
+    targets = np.array([ctl.slider(label, sliderType) for label in targetLabels])
+    references = np.array([ctl.slider(label, sliderType) for label in referenceLabels])
+    (orthovecs, weights) = orthogonalizeBatch(targets, references)
+
+    if not newLabels:
+        newLabels = ["%s orthogonal to %s" % (label, ', '.join(referenceLabels)) for label in targetLabels]
+    writer = CtlWriter(ctlfile)
+    for label, newLabel, vec, w in zip(targetLabels, newLabels, orthovecs, weights):
+        if np.isnan(w).any():
+            print("Slider %s lies (nearly) in the span of the reference sliders, %s NOT added to control file (%s)."
+                  % (label, newLabel, ctlfile))
+            continue
+        terms = ' + '.join("%.4f * %s" % (weight, reference) for weight, reference in zip(w, list(referenceLabels) + [label]))
+        print("%s = %s" % (newLabel, terms))
+        if ctl.has(newLabel, sliderType):
+            print("Slider %s already exists in control file (%s)." % (newLabel, ctlfile))
+        else:
+            writer.add(newLabel, vec, sliderType)
+
+    if len(writer) and not writer.commit():
+        print("Orthogonal sliders NOT added to control file:", ctlfile)
+        return False
+    return weights
+
 def printControlLabels(ctl):
+    if isinstance(ctl, CtlFile):
+        ctl = {section: list(zip(ctl.labels[section], ctl.sections[section])) for section in CTL_SECTIONS}
     for ctltype in ctl:
         for control in ctl[ctltype]:
             print(ctltype, control[0])
 
 def findControlByLabel(ctl, label, ctltype = 'GS'):
+    if isinstance(ctl, CtlFile):
+        return ctl.slider(label, ctltype)
     for control in ctl[ctltype]:
         if control[0] == label:
             return control[1]
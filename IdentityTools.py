@@ -0,0 +1,79 @@
+# Tools to generate face identities that are maximally different from each other
+# (Python counterpart of generate_identities.r)
+# by DongWon Oh (dongwonohphd@gmail.com)
+#
+# Candidates are random points in the 100-dimensional SS | TS face space. Two selections:
+#   removal   repeatedly drops the candidate with the lowest mean distance to the remaining
+#             candidates, as generate_identities.r does. The distance matrix is computed once
+#             (float32, n^2 * 4 bytes) and the row sums are updated by subtracting the dropped
+#             candidate's column instead of recomputing the matrix after every removal.
+#   farthest  greedy farthest-point selection: starts from the candidate farthest from the
+#             centroid and keeps adding the candidate farthest from everything selected so
+#             far. It only keeps one distance per candidate, so it scales to 100k candidates.
+
+import numpy as np
+
+# largest candidate set 'auto' selects by removal (a 10000 x 10000 float32 matrix is 400 MB)
+REMOVAL_MAX_CANDIDATES = 10000
+
+# seeded (n, 100) float32 Gaussian coordinates, as the simulated identities of generate_identities.r
+def simulateIdentities(n, seed=None, mu=0.0, sigma=1.0, scalingFactor=0.5, nCoords=100):
+    rng = np.random.default_rng(seed)
+    coords = rng.standard_normal((n, nCoords), dtype=np.float32)
+    return (coords * np.float32(sigma) + np.float32(mu)) * np.float32(scalingFactor)
+
+# Euclidean distances between the rows of a and b, computed in float32
+def _distances(a, b, bNorms=None):
+    if bNorms is None:
+        bNorms = np.einsum('ij,ij->i', b, b)
+    squared = np.einsum('ij,ij->i', a, a)[:, None] + bNorms[None, :] - 2 * (a @ b.T)
+    np.maximum(squared, 0, out=squared)
+    return np.sqrt(squared, out=squared)
+
+# returns the distance matrix of coords, filled blockSize rows at a time
+def distanceMatrix(coords, blockSize=2048):
+    coords = np.asarray(coords, dtype=np.float32)
+    norms = np.einsum('ij,ij->i', coords, coords)
+    out = np.empty((len(coords), len(coords)), dtype=np.float32)
+    for start in range(0, len(coords), blockSize):
+        rows = np.arange(start, min(start + blockSize, len(coords)))
+        out[rows] = _distances(coords[rows], coords, norms)
+        out[rows, rows] = 0
+    return out
+
+# indices of the n candidates left after removing the least distinct ones one by one
+def selectByRemoval(coords, n, blockSize=2048):
+    distances = distanceMatrix(coords, blockSize)
+    rowSums = distances.sum(axis=1, dtype=np.float64)
+    alive = np.ones(len(coords), dtype=bool)
+    for _ in range(len(coords) - n):
+        k = np.argmin(np.where(alive, rowSums, np.inf))
+        alive[k] = False
+        rowSums -= distances[k]
+    return np.flatnonzero(alive)
+
+# indices of n candidates chosen by greedy farthest-point selection, in the order they were chosen
+def selectFarthest(coords, n):
+    coords = np.asarray(coords, dtype=np.float32)
+    norms = np.einsum('ij,ij->i', coords, coords)
+    centroid = coords.mean(axis=0, keepdims=True)
+    selected = [int(np.argmax(_distances(centroid, coords, norms)[0]))]
+    nearest = _distances(coords[selected], coords, norms)[0]
+    for _ in range(n - 1):
+        k = int(np.argmax(nearest))
+        selected.append(k)
+        np.minimum(nearest, _distances(coords[k:k + 1], coords, norms)[0], out=nearest)
+    return np.array(selected)
+
+# selects n maximally different rows of coords with 'removal', 'farthest' or 'auto' (removal
+# up to REMOVAL_MAX_CANDIDATES candidates, farthest above); returns their indices
+def selectDiverse(coords, n, method='auto'):
+    if n >= len(coords):
+        return np.arange(len(coords))
+    if method == 'auto':
+        method = 'removal' if len(coords) <= REMOVAL_MAX_CANDIDATES else 'farthest'
+    if method == 'removal':
+        return selectByRemoval(coords, n)
+    if method == 'farthest':
+        return selectFarthest(coords, n)
+    raise ValueError("Unknown selection method: %s" % method)
@@ -2,7 +2,7 @@
 # by Ron Dotsch (rdotsch@gmail.com)
 
 from numpy import *
-from scipy.linalg import norm
+from numpy.linalg import norm, lstsq
 	
 def normalize(vec) :
 	return vec / norm(vec)
@@ -13,4 +13,22 @@ def orthogonalize(vec1, vec2) :
 	weights = array([1.0, -1.0/dot(vec1, vec2)])
 	weights = normalize(weights)
 	orthovec = normalize((weights[0] * vec1) + (weights[1] * vec2))
-	return (orthovec, weights)
\ No newline at end of file
+	return (orthovec, weights)
+
+# orthogonalizes each of the M target vectors (rows of targets) against all K reference vectors
+# (rows of references) at once: the least-squares projection on the span of the references is
+# subtracted and the residual normalized. Returns (orthovecs, weights) where weights[m] are the
+# mixing weights of [references..., target m] that give orthovecs[m]. A target whose residual is
+# shorter than tolerance times its own length lies (nearly) in the span of the references and
+# has no meaningful orthogonal direction; its rows of orthovecs and weights are NaN
+def orthogonalizeBatch(targets, references, tolerance=1e-3) :
+	targets = atleast_2d(asarray(targets, dtype=float64))
+	references = atleast_2d(asarray(references, dtype=float64))
+	coefficients = lstsq(references.T, targets.T, rcond=None)[0].T
+	residuals = targets - coefficients @ references
+	norms = norm(residuals, axis=1)
+	degenerate = norms <= tolerance * norm(targets, axis=1)
+	norms[degenerate] = nan
+	orthovecs = residuals / norms[:, newaxis]
+	weights = hstack([-coefficients, ones((len(targets), 1))]) / norms[:, newaxis]
+	return (orthovecs, weights)
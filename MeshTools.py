@@ -0,0 +1,283 @@
+# Mesh tools for FaceGen faces that run without the FaceGen SDK
+# by DongWon Oh (dongwonohphd@gmail.com)
+#
+# Vertex positions of a face are the base mesh of a .tri file plus the .egm statistical
+# modes weighted by the face's coordinates:
+#   vertices = base + SS . symmetric modes + SA . asymmetric modes
+# which for a batch of faces is two matrix products, (N, S) x (S, V*3) and (N, A) x (A, V*3).
+#
+# Meshes are exported as OBJ, binary PLY or binary glTF (.glb) without the SDK. Everything that
+# only depends on the .tri file (triangulated quads, texture coordinates, the face block of every
+# format) is prepared once in MeshTopology and shared by all faces; per face only the vertex and
+# normal blocks are written, from one format string or one raw buffer each. Vertex normals are
+# the area-weighted sums of the normals of the adjacent triangles, for a batch of faces at once.
+
+import os
+import json
+import struct
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from FGBinTools import EgmFile, TriFile, readFGBatch, FG_SLICES, FG_COORD_SCALE
+
+class ShapeModel:
+
+    # egm and tri are file names or already opened EgmFile / TriFile objects
+    def __init__(self, egm, tri):
+        if not isinstance(egm, EgmFile):
+            egm = EgmFile(egm)
+        if not isinstance(tri, TriFile):
+            tri = TriFile(tri)
+        if egm.V != tri.V:
+            raise ValueError("EGM has %i vertices but TRI has %i." % (egm.V, tri.V))
+
+        self.egm = egm
+        self.tri = tri
+        self.V = tri.V
+        self.base = np.array(tri.vert[:tri.V], dtype=np.float32)
+        self.symBasis = egm.modes('S').reshape(egm.S, 3 * self.V)
+        self.asymBasis = egm.modes('A').reshape(egm.A, 3 * self.V)
+
+    # splits (N, 130) .fg coordinates into float mode weights for this model
+    def _weights(self, coords):
+        coords = np.asarray(coords, dtype=np.float32) / FG_COORD_SCALE
+        ss = coords[:, FG_SLICES['SS']][:, :self.egm.S]
+        sa = coords[:, FG_SLICES['SA']][:, :self.egm.A]
+        return ss, sa
+
+    # yields (start, vertices) with (n, V, 3) float32 vertex positions for chunkSize faces at a time
+    def iterSynthesize(self, coords, chunkSize=256):
+        for start in range(0, len(coords), chunkSize):
+            ss, sa = self._weights(coords[start:start + chunkSize])
+            flat = ss @ self.symBasis
+            if sa.shape[1]:
+                flat += sa @ self.asymBasis
+            vertices = flat.reshape(len(flat), self.V, 3)
+            vertices += self.base
+            yield start, vertices
+
+    # returns (N, V, 3) float32 vertex positions for (N, 130) .fg coordinates; out may be a
+    # preallocated array (e.g. a np.memmap) when the result does not fit in memory
+    def synthesize(self, coords, chunkSize=256, out=None):
+        if out is None:
+            out = np.empty((len(coords), self.V, 3), dtype=np.float32)
+        for start, vertices in self.iterSynthesize(coords, chunkSize):
+            out[start:start + len(vertices)] = vertices
+        return out
+
+# returns (names, vertices) for a list of .fg files
+def synthesizeFG(FGFileNames, egmFileName, triFileName, chunkSize=256, threads=None):
+    model = ShapeModel(egmFileName, triFileName)
+    names, coords = readFGBatch(FGFileNames, threads)
+    return names, model.synthesize(coords, chunkSize)
+
+# mesh file formats that exportMeshes can write
+MESH_FORMATS = ('obj', 'ply', 'glb')
+
+# Triangulated topology of a .tri file. faces are the (F, 3) triangles, quads split along their
+# first diagonal. OBJ keeps the positions and texture coordinates of the .tri file apart (uvFaces
+# index uv); PLY and glTF have one texture coordinate per vertex, so their vertices are split
+# where a vertex has several texture coordinates: output vertex i is vertex vertexMap[i] with
+# texture coordinate vertexUV[i], and splitFaces index these output vertices.
+class MeshTopology:
+
+    # tri is a file name or an already opened TriFile
+    def __init__(self, tri):
+        if not isinstance(tri, TriFile):
+            tri = TriFile(tri)
+        self.V = tri.V
+        quads = np.asarray(tri.quad, dtype=np.int32)
+        self.faces = np.concatenate([np.asarray(tri.tri, dtype=np.int32), quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]])
+        self.uv = np.array(tri.tex, dtype=np.float32)
+
+        if len(tri.ttInd) + len(tri.qtInd):
+            quadUV = np.asarray(tri.qtInd, dtype=np.int32)
+            self.uvFaces = np.concatenate([np.asarray(tri.ttInd, dtype=np.int32), quadUV[:, [0, 1, 2]], quadUV[:, [0, 2, 3]]])
+            pairs = self.faces.astype(np.int64) * len(self.uv) + self.uvFaces
+            unique, inverse = np.unique(pairs, return_inverse=True)
+            self.vertexMap = (unique // len(self.uv)).astype(np.int32)
+            self.vertexUV = self.uv[unique % len(self.uv)]
+            self.splitFaces = inverse.reshape(-1, 3).astype(np.int32)
+        else:
+            self.uvFaces = self.faces if len(self.uv) else None
+            self.vertexMap = np.arange(self.V, dtype=np.int32)
+            self.vertexUV = self.uv if len(self.uv) else None
+            self.splitFaces = self.faces
+        self._blocks = {}
+
+    @property
+    def F(self):
+        return len(self.faces)
+
+    # OBJ lines of the texture coordinates and faces (1-based v/vt/vn indices, normals per vertex)
+    def _objBlocks(self):
+        if 'obj' not in self._blocks:
+            uv = ''
+            if self.uvFaces is None:
+                indices = np.stack([self.faces, self.faces], axis=2) + 1
+                faces = ('f %d//%d %d//%d %d//%d\n' * self.F) % tuple(indices.ravel().tolist())
+            else:
+                uv = ('vt %.7g %.7g\n' * len(self.uv)) % tuple(self.uv.ravel().tolist())
+                indices = np.stack([self.faces, self.uvFaces, self.faces], axis=2) + 1
+                faces = ('f %d/%d/%d %d/%d/%d %d/%d/%d\n' * self.F) % tuple(indices.ravel().tolist())
+            self._blocks['obj'] = (uv.encode('ascii'), faces.encode('ascii'))
+        return self._blocks['obj']
+
+    # PLY header and face list (uint8 count and three int32 indices per triangle)
+    def _plyBlocks(self):
+        if 'ply' not in self._blocks:
+            properties = ['x', 'y', 'z', 'nx', 'ny', 'nz'] + (['s', 't'] if self.vertexUV is not None else [])
+            header = ['ply', 'format binary_little_endian 1.0', 'element vertex %i' % len(self.vertexMap)]
+            header += ['property float %s' % name for name in properties]
+            header += ['element face %i' % self.F, 'property list uchar int vertex_indices', 'end_header']
+            faces = np.empty(self.F, dtype=[('n', 'u1'), ('indices', '<i4', (3, ))])
+            faces['n'] = 3
+            faces['indices'] = self.splitFaces
+            self._blocks['ply'] = (('\n'.join(header) + '\n').encode('ascii'), faces.tobytes(),
+                                   np.dtype([(name, '<f4') for name in properties]))
+        return self._blocks['ply']
+
+    # glTF buffer views and accessors (indices, positions, normals, texture coordinates) and the
+    # index and texture coordinate bytes, which are the same for every face
+    def _glbBlocks(self):
+        if 'glb' not in self._blocks:
+            U = len(self.vertexMap)
+            indices = self.splitFaces.astype('<u4').tobytes()
+            uv = b''
+            if self.vertexUV is not None:
+                # glTF texture coordinates start at the top of the image
+                uv = np.column_stack([self.vertexUV[:, 0], 1 - self.vertexUV[:, 1]]).astype('<f4').tobytes()
+            lengths = [len(indices), U * 12, U * 12, len(uv)]
+            offsets = np.cumsum([0] + lengths[:-1]).tolist()
+            views = [{'buffer': 0, 'byteOffset': offset, 'byteLength': length, 'target': target}
+                     for offset, length, target in zip(offsets, lengths, (34963, 34962, 34962, 34962)) if length]
+            accessors = [{'bufferView': 0, 'componentType': 5125, 'count': self.F * 3, 'type': 'SCALAR'},
+                         {'bufferView': 1, 'componentType': 5126, 'count': U, 'type': 'VEC3'},
+                         {'bufferView': 2, 'componentType': 5126, 'count': U, 'type': 'VEC3'}]
+            attributes = {'POSITION': 1, 'NORMAL': 2}
+            if uv:
+                accessors.append({'bufferView': 3, 'componentType': 5126, 'count': U, 'type': 'VEC2'})
+                attributes['TEXCOORD_0'] = 3
+            self._blocks['glb'] = (indices, uv, sum(lengths), views, accessors, attributes)
+        return self._blocks['glb']
+
+# returns (N, V, 3) float32 unit vertex normals of (N, V, 3) vertex positions (or (V, 3) normals of
+# one face) and (F, 3) triangles
+def vertexNormals(vertices, faces):
+    vertices = np.asarray(vertices, dtype=np.float32)
+    single = vertices.ndim == 2
+    vertices = vertices[None] if single else vertices
+    N, V = vertices.shape[:2]
+    corners = vertices[:, faces]
+    # cross products are twice the triangle areas long, which weights the sums by area
+    faceNormals = np.cross(corners[:, :, 1] - corners[:, :, 0], corners[:, :, 2] - corners[:, :, 0])
+    targets = (np.arange(N)[:, None] * V + np.asarray(faces).ravel()).ravel()
+    weights = np.repeat(faceNormals, 3, axis=1).reshape(-1, 3)
+    normals = np.stack([np.bincount(targets, weights[:, k], minlength=N * V) for k in range(3)], axis=1)
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = (normals / np.where(lengths == 0, 1, lengths)).astype(np.float32).reshape(N, V, 3)
+    return normals[0] if single else normals
+
+# writes one face's (V, 3) vertices and normals as an OBJ file
+def writeOBJ(fileName, vertices, normals, topology):
+    uv, faces = topology._objBlocks()
+    with open(fileName, 'wb') as obj:
+        obj.write(b'# %s\n' % os.path.basename(fileName).encode('utf-8', 'replace'))
+        obj.write((('v %.7g %.7g %.7g\n' * topology.V) % tuple(np.asarray(vertices).ravel().tolist())).encode('ascii'))
+        obj.write(uv)
+        obj.write((('vn %.4f %.4f %.4f\n' * topology.V) % tuple(np.asarray(normals).ravel().tolist())).encode('ascii'))
+        obj.write(faces)
+
+# writes one face's (V, 3) vertices and normals as a binary little-endian PLY file
+def writePLY(fileName, vertices, normals, topology):
+    header, faces, dtype = topology._plyBlocks()
+    block = np.empty(len(topology.vertexMap), dtype=dtype)
+    for k, (position, normal) in enumerate(zip('xyz', ('nx', 'ny', 'nz'))):
+        block[position] = vertices[topology.vertexMap, k]
+        block[normal] = normals[topology.vertexMap, k]
+    if topology.vertexUV is not None:
+        block['s'], block['t'] = topology.vertexUV[:, 0], topology.vertexUV[:, 1]
+    with open(fileName, 'wb') as ply:
+        ply.write(header)
+        ply.write(block.tobytes())
+        ply.write(faces)
+
+# writes one face's (V, 3) vertices and normals as a binary glTF 2.0 file (.glb)
+def writeGLB(fileName, vertices, normals, topology, name=None):
+    indices, uv, length, views, accessors, attributes = topology._glbBlocks()
+    positions = np.ascontiguousarray(vertices[topology.vertexMap], dtype='<f4')
+    accessors = [dict(accessor) for accessor in accessors]
+    accessors[1]['min'] = positions.min(axis=0).tolist()
+    accessors[1]['max'] = positions.max(axis=0).tolist()
+    name = name or os.path.splitext(os.path.basename(fileName))[0]
+    gltf = {'asset': {'version': '2.0', 'generator': 'FGBinTools MeshTools'},
+            'scene': 0, 'scenes': [{'nodes': [0]}], 'nodes': [{'mesh': 0, 'name': name}],
+            'meshes': [{'name': name, 'primitives': [{'attributes': attributes, 'indices': 0, 'mode': 4}]}],
+            'buffers': [{'byteLength': length}], 'bufferViews': views, 'accessors': accessors}
+    content = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+    content += b' ' * (-len(content) % 4)
+    with open(fileName, 'wb') as glb:
+        glb.write(struct.pack('<III', 0x46546C67, 2, 12 + 8 + len(content) + 8 + length))
+        glb.write(struct.pack('<II', len(content), 0x4E4F534A))
+        glb.write(content)
+        glb.write(struct.pack('<II', length, 0x004E4942))
+        glb.write(indices)
+        glb.write(positions.tobytes())
+        glb.write(np.ascontiguousarray(normals[topology.vertexMap], dtype='<f4').tobytes())
+        glb.write(uv)
+
+MESH_WRITERS = {'obj': writeOBJ, 'ply': writePLY, 'glb': writeGLB}
+
+_topology = {}
+
+def _setTopology(topology):
+    _topology['mesh'] = topology
+
+# computes the normals of a batch of (n, V, 3) vertices and writes one mesh file per face
+def _writeMeshes(fileNames, vertices, fmt):
+    topology = _topology['mesh']
+    normals = vertexNormals(vertices, topology.faces)
+    for fileName, faceVertices, faceNormals in zip(fileNames, vertices, normals):
+        MESH_WRITERS[fmt](fileName, faceVertices, faceNormals, topology)
+    return len(fileNames)
+
+# Writes one mesh file per face to outputDir as <name>.<fmt> (fmt is 'obj', 'ply' or 'glb').
+# vertices is an (N, V, 3) array or an iterable of (start, (n, V, 3) vertices) chunks as
+# ShapeModel.iterSynthesize yields; topology a MeshTopology, TriFile or .tri file name. Batches of
+# batchSize faces are written in a pool of `processes` workers that all receive the topology
+# once (in this process if processes is 1). Returns the list of written file names.
+def exportMeshes(names, vertices, topology, outputDir, fmt='obj', processes=None, batchSize=16):
+    if fmt not in MESH_WRITERS:
+        raise ValueError("Unknown mesh format: %s" % fmt)
+    if not isinstance(topology, MeshTopology):
+        topology = MeshTopology(topology)
+    names = [str(name) for name in names]
+    fileNames = [os.path.join(outputDir, '%s.%s' % (name, fmt)) for name in names]
+    os.makedirs(outputDir, exist_ok=True)
+    # the blocks shared by all faces are built before the topology is sent to the workers
+    getattr(topology, '_%sBlocks' % fmt)()
+    chunks = ((0, vertices), ) if isinstance(vertices, np.ndarray) else vertices
+    batches = ((fileNames[start + i:start + i + batchSize], chunk[i:i + batchSize])
+               for start, chunk in chunks for i in range(0, len(chunk), batchSize))
+
+    if processes is None or processes > 1:
+        workers = processes or os.cpu_count() or 1
+        with ProcessPoolExecutor(workers, initializer=_setTopology, initargs=(topology, )) as executor:
+            pending = []
+            for batch in batches:
+                pending.append(executor.submit(_writeMeshes, *batch, fmt))
+                # keep the synthesized vertices of at most a few batches per worker in memory
+                if len(pending) >= 4 * workers:
+                    pending.pop(0).result()
+            for future in pending:
+                future.result()
+    else:
+        _setTopology(topology)
+        for batch in batches:
+            _writeMeshes(*batch, fmt)
+    return fileNames
+
+# synthesizes the meshes of .fg files and writes them to outputDir; see exportMeshes
+def exportFG(FGFileNames, egmFileName, triFileName, outputDir, fmt='obj', chunkSize=256, processes=None, threads=None):
+    model = ShapeModel(egmFileName, triFileName)
+    names, coords = readFGBatch(FGFileNames, threads)
+    return exportMeshes(names, model.iterSynthesize(coords, chunkSize), MeshTopology(model.tri), outputDir, fmt, processes)
@@ -0,0 +1,368 @@
+# Tools to build and apply data-driven face models (Python counterpart of build_model.r)
+# by DongWon Oh (dongwonohphd@gmail.com)
+#
+# A reverse-correlation model of a trait is the cross-product of the centered ratings and the
+# face coordinates, crossprod(scale(ratings, scale=F), coords) in build_model.r. Models live in
+# the 100-dimensional symmetric face space (50 SS followed by 50 TS coordinates), the same
+# layout as si-todorov.csv.
+
+import os
+import re
+import csv
+import numpy as np
+from FGBinTools import CtlWriter, loadCtl, listFG, readFGBatch, writeFGBatch, toFGCoords, loadFaces, loadControls, \
+    FG_SLICES, FG_NCOORDS
+from CorpusTools import FGCorpus
+
+# returns the (N, 100) SS | TS columns of (N, 130) .fg coordinates, (N, 100) input is returned as is
+def symmetricCoords(coords):
+    coords = np.asarray(coords)
+    if coords.shape[1] == FG_NCOORDS:
+        return np.concatenate([coords[:, FG_SLICES['SS']], coords[:, FG_SLICES['TS']]], axis=1)
+    return coords
+
+# Normalizes (M, 100) models:
+#   'split' scales the shape (first 50) and texture (last 50) halves to unit length each, as in
+#           si-todorov.csv and the sliders written by csv2ctl.py
+#   'l2'    scales the whole vector to unit length
+#   'max'   divides by the largest absolute value, which is what norm(m) does in build_model.r
+#   None    leaves the models unchanged
+# reference optionally gives (M, 100) models whose norms are used instead of those of the models
+# themselves, so that resampled models keep the scale of the observed ones
+def normalizeModels(models, normalization='split', reference=None):
+    models = np.array(models, dtype=np.float64)
+    reference = models if reference is None else np.asarray(reference, dtype=np.float64)
+    if normalization == 'split':
+        half = models.shape[1] // 2
+        for part in (slice(0, half), slice(half, None)):
+            norms = np.linalg.norm(reference[:, part], axis=1, keepdims=True)
+            models[:, part] /= np.where(norms == 0, 1, norms)
+    elif normalization == 'l2':
+        norms = np.linalg.norm(reference, axis=1, keepdims=True)
+        models /= np.where(norms == 0, 1, norms)
+    elif normalization == 'max':
+        norms = np.abs(reference).max(axis=1, keepdims=True)
+        models /= np.where(norms == 0, 1, norms)
+    elif normalization is not None:
+        raise ValueError("Unknown normalization: %s" % normalization)
+    return models
+
+# Accumulates the centered cross-products of ratings and coordinates over chunks of rows, so
+# rating tables of any size can be streamed. Every trait keeps its own count, means and
+# co-moments (merged with Chan et al.'s pairwise update), so missing ratings (NaN) only drop
+# that trait's observation and large offsets in the data do not cancel out.
+class ModelBuilder:
+
+    def __init__(self, traits, nCoords=100):
+        self.traits = list(traits)
+        T = len(self.traits)
+        self.n = np.zeros(T)
+        self.meanRating = np.zeros(T)
+        self.meanCoords = np.zeros((T, nCoords))
+        self.comoment = np.zeros((T, nCoords))
+
+    # ratings is (n, T) with NaN for missing ratings, coords the (n, 100) coordinates of the rated faces
+    def update(self, ratings, coords):
+        ratings = np.asarray(ratings, dtype=np.float64).reshape(len(coords), len(self.traits))
+        coords = np.asarray(coords, dtype=np.float64)
+        mask = ~np.isnan(ratings)
+        ratings = np.where(mask, ratings, 0)
+
+        n = mask.sum(axis=0).astype(np.float64)
+        safe = np.where(n == 0, 1, n)
+        meanRating = ratings.sum(axis=0) / safe
+        meanCoords = (mask.T.astype(np.float64) @ coords) / safe[:, None]
+        centered = np.where(mask, ratings - meanRating, 0)
+        comoment = centered.T @ coords
+        self._merge(n, meanRating, meanCoords, comoment)
+
+    def merge(self, other):
+        self._merge(other.n, other.meanRating, other.meanCoords, other.comoment)
+
+    def _merge(self, n, meanRating, meanCoords, comoment):
+        total = self.n + n
+        safe = np.where(total == 0, 1, total)
+        deltaRating = meanRating - self.meanRating
+        deltaCoords = meanCoords - self.meanCoords
+        self.comoment += comoment + (self.n * n / safe)[:, None] * deltaRating[:, None] * deltaCoords
+        self.meanRating += deltaRating * n / safe
+        self.meanCoords += deltaCoords * (n / safe)[:, None]
+        self.n = total
+
+    # (T, 100) un-normalized models, crossprod(scale(ratings, scale=F), coords) for every trait
+    def crossprod(self):
+        return self.comoment.copy()
+
+    def models(self, normalization='split'):
+        return normalizeModels(self.comoment, normalization)
+
+# builds all trait models at once from (N, T) ratings and the (N, 100) or (N, 130) coordinates
+# of the rated faces; returns (T, 100) models
+def buildModels(ratings, coords, normalization='split'):
+    ratings = np.asarray(ratings, dtype=np.float64)
+    if ratings.ndim == 1:
+        ratings = ratings[:, None]
+    builder = ModelBuilder(range(ratings.shape[1]))
+    builder.update(ratings, symmetricCoords(coords))
+    return builder.models(normalization)
+
+# Looks up face coordinates by name in a directory of .fg files, an FGCorpus file (.fgc) or an
+# .npz file written by fg2csv.py; returns a function mapping names to (found, (n, 100) coords)
+def faceLookup(faces):
+    if os.path.isdir(faces):
+        def lookup(names):
+            paths = [os.path.join(faces, name + '.fg') for name in names]
+            exists = np.array([os.path.exists(path) for path in paths], dtype=bool)
+            found, coords = readFGBatch([path for path, ok in zip(paths, exists) if ok])
+            index = {name: row for row, name in enumerate(found)}
+            keep = np.array([ok and name in index for name, ok in zip(names, exists)], dtype=bool)
+            return keep, symmetricCoords(coords[[index[name] for name, ok in zip(names, keep) if ok]])
+        return lookup
+
+    if faces.endswith('.npz'):
+        faceNames, faceCoords = loadFaces(faces)
+        index = {name: row for row, name in enumerate(faceNames)}
+    else:
+        corpus = FGCorpus(faces)
+        index, faceCoords = corpus.index, corpus.coords
+
+    def lookup(names):
+        keep = np.array([name in index for name in names], dtype=bool)
+        rows = [index[name] for name, ok in zip(names, keep) if ok]
+        return keep, symmetricCoords(faceCoords[rows])
+    return lookup
+
+def _rating(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+# Reads a ratings csv (a header, the face name in nameColumn and one column per trait) in
+# chunks of chunkRows rows and looks up the rated faces in `faces` (see faceLookup); yields
+# (traits, (n, T) ratings, (n, 100) coords) for every chunk, skipping faces that were not found
+def iterRatings(ratingsFile, faces, traits=None, nameColumn=0, chunkRows=100000):
+    lookup = faceLookup(faces)
+    missing = 0
+    with open(ratingsFile, 'r', newline='') as source:
+        reader = csv.reader(source)
+        header = next(reader, None)
+        if header is None:
+            raise ValueError("%s is empty." % ratingsFile)
+        if traits is None:
+            traits = [column for i, column in enumerate(header) if i != nameColumn]
+        absent = [trait for trait in traits if trait not in header]
+        if absent:
+            raise ValueError("Traits not found in the header of %s: %s" % (ratingsFile, ', '.join(absent)))
+        columns = [header.index(trait) for trait in traits]
+
+        while True:
+            rows = [row for _, row in zip(range(chunkRows), reader)]
+            if not rows:
+                break
+            names = [os.path.splitext(row[nameColumn])[0] if row[nameColumn].endswith('.fg') else row[nameColumn]
+                     for row in rows]
+            ratings = np.array([[_rating(row[column]) for column in columns] for row in rows])
+            found, coords = lookup(names)
+            missing += len(found) - found.sum()
+            yield traits, ratings[found], coords
+
+    if missing:
+        print("Warning: %i rated faces were not found and were skipped" % missing)
+
+# streams a ratings csv (see iterRatings) and returns a ModelBuilder with the accumulated
+# cross-products of all traits, or of the given traits
+def buildModelsFromFiles(ratingsFile, faces, traits=None, nameColumn=0, chunkRows=100000):
+    builder = None
+    for traits, ratings, coords in iterRatings(ratingsFile, faces, traits, nameColumn, chunkRows):
+        if builder is None:
+            builder = ModelBuilder(traits)
+        builder.update(ratings, coords)
+    return builder if builder is not None else ModelBuilder(traits or [])
+
+# reads a whole ratings csv (see iterRatings) into memory; returns (traits, (N, T) ratings, (N, 100) coords)
+def loadRatings(ratingsFile, faces, traits=None, nameColumn=0):
+    chunks = list(iterRatings(ratingsFile, faces, traits, nameColumn))
+    if not chunks:
+        return traits or [], np.zeros((0, len(traits or []))), np.zeros((0, 100))
+    return chunks[0][0], np.concatenate([c[1] for c in chunks]), np.concatenate([c[2] for c in chunks])
+
+# writes models as a csv with a header row and one model per row (label, 100 values), the layout
+# csv2ctl.py reads
+def writeModelsCsv(fileName, labels, models):
+    with open(fileName, 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(['label'] + ['D%i' % (i + 1) for i in range(np.shape(models)[1])])
+        for label, model in zip(labels, np.asarray(models).tolist()):
+            writer.writerow([label] + model)
+
+# inserts every model into a control file as a shape (SS) and a texture (TS) slider in one write
+def writeModelsCtl(ctlFileName, labels, models):
+    models = normalizeModels(models, 'split')
+    writer = CtlWriter(ctlFileName)
+    for label, model in zip(labels, models):
+        writer.add(label, model[:50], 'SS')
+        writer.add(label, model[50:], 'TS')
+    return writer.commit()
+
+def _isNumber(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+# Reads (M, 100) models from a control file (every label that has both a GS and a TS slider,
+# the layout csv2ctl.py writes), a controls .npz file or a csv of label + 100 values with or
+# without a header (si-todorov.csv, build_model.py); returns (labels, models), restricted to
+# the given labels if any
+def readModels(fileName, labels=None):
+    if fileName.endswith('.ctl'):
+        ctl = loadCtl(fileName)
+        found = [label for label in ctl.labels['GS'] if ctl.has(label, 'TS')]
+        found = list(dict.fromkeys(found))
+        models = np.array([np.concatenate([ctl.slider(label, 'GS'), ctl.slider(label, 'TS')]) for label in found],
+                          dtype=np.float64).reshape(len(found), -1)
+    elif fileName.endswith('.npz'):
+        found, shape, texture = loadControls(fileName)
+        found = list(found)
+        models = np.concatenate([shape, texture], axis=1).astype(np.float64)
+    else:
+        with open(fileName, 'r', newline='') as source:
+            rows = [row for row in csv.reader(source) if row]
+        if rows and not _isNumber(rows[0][1]):
+            rows = rows[1:]
+        found = [row[0] for row in rows]
+        models = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), -1)
+
+    if labels is not None:
+        index = {label: row for row, label in reversed(list(enumerate(found)))}
+        absent = [label for label in labels if label not in index]
+        if absent:
+            print("Models not found in %s: %s" % (fileName, ', '.join(absent)))
+        labels = [label for label in labels if label in index]
+        return labels, models[np.array([index[label] for label in labels], dtype=int)]
+    return found, models
+
+# Reads identities from a directory of .fg files, an FG corpus file (.fgc), a faces .npz file or
+# a csv (fg2csv.py output, or name + 100 SS | TS values as in the R scripts); returns
+# (names, (N, 100) coordinates)
+def loadIdentities(source, threads=None):
+    if os.path.isdir(source):
+        names, coords = readFGBatch(listFG(source), threads)
+    elif source.endswith('.npz'):
+        names, coords = loadFaces(source)
+    elif source.endswith('.csv'):
+        with open(source, 'r', newline='') as identities:
+            rows = [row for row in csv.reader(identities) if row]
+        values = [row[3:] if len(row) == 3 + FG_NCOORDS else row[1:] for row in rows]
+        if values and not _isNumber(values[0][0]):
+            rows, values = rows[1:], values[1:]
+        names = [row[0] for row in rows]
+        coords = np.array(values, dtype=np.float64).reshape(len(rows), -1)
+    else:
+        corpus = FGCorpus(source)
+        names, coords = corpus.names, corpus.coords
+    return [str(name) for name in names], symmetricCoords(coords)
+
+# Yields (start, shape, texture, combined) projections of chunkSize identities at a time on all
+# models, each (n, M): the projection of an identity v on a model s is v.s / s.s, computed
+# over the shape halves, the texture halves and the whole vectors. As in vary_on_model.R,
+# modelScale (1000 for .fg coordinates) is applied to the models first.
+def iterProjections(identities, models, chunkSize=100000, modelScale=1.0):
+    models = np.asarray(models, dtype=np.float64) * modelScale
+    half = models.shape[1] // 2
+    projectors = []
+    for part in (slice(0, half), slice(half, None), slice(None)):
+        norms = (models[:, part] ** 2).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            projectors.append((models[:, part] / np.where(norms == 0, np.nan, norms)[:, None]).T)
+
+    for start in range(0, len(identities), chunkSize):
+        chunk = np.asarray(symmetricCoords(identities[start:start + chunkSize]), dtype=np.float64)
+        yield (start, chunk[:, :half] @ projectors[0], chunk[:, half:] @ projectors[1], chunk @ projectors[2])
+
+# returns the (N, M) shape, texture and combined projections of (N, 100) identities on (M, 100) models
+def projectModels(identities, models, chunkSize=100000, modelScale=1.0):
+    shape = np.empty((len(identities), len(models)))
+    texture = np.empty_like(shape)
+    combined = np.empty_like(shape)
+    for start, *projections in iterProjections(identities, models, chunkSize, modelScale):
+        for out, projection in zip((shape, texture, combined), projections):
+            out[start:start + len(projection)] = projection
+    return shape, texture, combined
+
+# writes the projections of identities on models to a csv, one row per identity and projection
+# type (shape.and.texture, shape.only, texture.only) and one column per model, as vary_on_model.R
+def writeProjectionsCsv(fileName, names, labels, identities, models, modelScale=1000.0):
+    with open(fileName, 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(['identity', 'projection.type'] + list(labels))
+        for start, shape, texture, combined in iterProjections(identities, models, modelScale=modelScale):
+            for i, name in enumerate(names[start:start + len(shape)]):
+                writer.writerow([name, 'shape.and.texture'] + combined[i].tolist())
+                writer.writerow([name, 'shape.only'] + shape[i].tolist())
+                writer.writerow([name, 'texture.only'] + texture[i].tolist())
+
+# Moves every identity along every model to every level of a range, as vary_on_model.R does:
+# a point is identity + (level - projection) * model, separately for the shape and the texture
+# half, so its shape (texture) projection on the model equals the shape (texture) level.
+# With relative=True the levels are offsets from the identity's own projections instead
+# (vary_on_model_add.R). identities are (N, 100) or (N, 130), the asymmetric coordinates of
+# (N, 130) identities are kept as they are. shapeLevels and textureLevels have the same length L,
+# textureLevels defaults to shapeLevels.
+# Returns (coords (N, M, L, width), closest (N, M, 2) index of the level nearest to the
+# identity for shape and texture, levels (N, M, L, 2) shape and texture projections of every point)
+def varyOnModels(identities, models, shapeLevels, textureLevels=None, relative=False, modelScale=1000.0):
+    identities = np.asarray(identities, dtype=np.float64)
+    models = np.asarray(models, dtype=np.float64) * modelScale
+    shapeLevels = np.asarray(shapeLevels, dtype=np.float64)
+    textureLevels = shapeLevels if textureLevels is None else np.asarray(textureLevels, dtype=np.float64)
+    if shapeLevels.shape != textureLevels.shape:
+        raise ValueError("Shape and texture ranges need the same number of levels.")
+
+    shape, texture, _ = projectModels(identities, models)
+    projections = np.stack([shape, texture], axis=-1)[:, :, None, :]
+    levels = np.stack([shapeLevels, textureLevels], axis=-1)
+    if relative:
+        levels = projections + levels
+    else:
+        levels = np.broadcast_to(levels, projections.shape[:2] + levels.shape)
+    closest = np.abs(levels - projections).argmin(axis=2)
+    steps = levels - projections
+
+    width = identities.shape[1]
+    columns = (FG_SLICES['SS'], FG_SLICES['TS']) if width == FG_NCOORDS else (slice(0, 50), slice(50, 100))
+    coords = np.empty(identities.shape[:1] + models.shape[:1] + shapeLevels.shape + (width, ))
+    coords[...] = identities[:, None, None, :]
+    coords[..., columns[0]] += steps[..., 0, None] * models[None, :, None, :50]
+    coords[..., columns[1]] += steps[..., 1, None] * models[None, :, None, 50:]
+    return coords, closest, np.ascontiguousarray(levels)
+
+# file name of one point of a variation grid, points are numbered from 1 as in vary_on_model.R
+def variationName(identity, label, point):
+    return '%s_%s_%i' % (identity, re.sub(r'[^\w.-]+', '_', label).strip('_'), point + 1)
+
+# writes (N, 100) or (N, 130) coordinates as .fg files into a directory, or appends them to an
+# FG corpus when output ends in .fgc (the corpus is created if needed); returns True or False
+def writeFaces(output, names, coords, threads=None):
+    coords = toFGCoords(coords)
+    if coords is False:
+        return False
+    if output.endswith('.fgc'):
+        corpus = FGCorpus(output, 'r+') if os.path.exists(output) else FGCorpus.create(output)
+        written = corpus.append(names, coords)
+        corpus.close()
+        return written
+    os.makedirs(output, exist_ok=True)
+    return writeFGBatch([os.path.join(output, name + '.fg') for name in names], coords, threads)
+
+# writes a variation grid from varyOnModels with writeFaces; returns the face names in grid
+# order (identity, model, level), or False if the faces could not be written
+def writeVariations(output, identityNames, labels, coords, threads=None):
+    N, M, L, width = coords.shape
+    names = [variationName(identity, label, point)
+             for identity in identityNames for label in labels for point in range(L)]
+    if not writeFaces(output, names, coords.reshape(N * M * L, width), threads):
+        return False
+    return names
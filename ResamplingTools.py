@@ -0,0 +1,145 @@
+# Permutation tests and bootstrap confidence intervals for reverse-correlation models
+# by DongWon Oh (dongwonohphd@gmail.com)
+#
+# Every resample of a model is one centered cross-product (see ModelTools), so a batch of B
+# resamples of all T traits is a handful of (B, N) x (N, 100) matrix products. Batches run in
+# a process pool; the ratings and the face coordinates are put in shared memory once and
+# every worker maps them instead of receiving a copy with each batch.
+#
+# Every batch draws from its own random stream, spawned from one seed, so the results only
+# depend on the seed and the batch size and not on the number of worker processes.
+#
+# Like ModelBuilder, every trait is resampled over its own rated faces, so a missing rating
+# (NaN) only drops that trait's observation. Bootstrap models are normalized with the norms of
+# the observed models: normalizing every resample to unit length would shrink the intervals,
+# since resampling noise makes the resampled models longer. For the same reason permuted
+# models are compared with the observed one before any normalization.
+
+import csv
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from ModelTools import normalizeModels, symmetricCoords
+
+RESAMPLING_BATCH = 100
+
+_shared = {}
+
+# copies an array into a new shared memory block; returns (block, description for the workers)
+def _share(array):
+    array = np.ascontiguousarray(array, dtype=np.float64)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape)
+
+def _attach(ratings, coords):
+    for key, (name, shape) in (('ratings', ratings), ('coords', coords)):
+        block = shared_memory.SharedMemory(name=name)
+        _shared[key + 'Block'] = block
+        _shared[key] = np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+
+# counts for every trait and coordinate how often a permuted cross-product is at least as large
+# (in absolute value) as the observed (T, D) cross-product; both are compared un-normalized,
+# since normalizing every permutation by its own norms would discard the magnitude under test
+def _permutationBatch(seed, size, observed):
+    ratings, coords = _shared['ratings'], _shared['coords']
+    rng = np.random.default_rng(seed)
+    T = ratings.shape[1]
+    models = np.zeros((size, T, coords.shape[1]))
+    for t in range(T):
+        rows = np.flatnonzero(~np.isnan(ratings[:, t]))
+        order = rng.permuted(np.broadcast_to(np.arange(len(rows)), (size, len(rows))), axis=1)
+        models[:, t] = ratings[rows[order], t] @ coords[rows]
+    return (np.abs(models) >= np.abs(observed) * (1 - 1e-12)).sum(axis=0)
+
+# returns (size, T, D) models of rows drawn with replacement, normalized like the observed
+# (T, D) cross-products
+def _bootstrapBatch(seed, size, observed, normalization):
+    ratings, coords = _shared['ratings'], _shared['coords']
+    rng = np.random.default_rng(seed)
+    T = ratings.shape[1]
+    models = np.zeros((size, T, coords.shape[1]))
+    for t in range(T):
+        rows = np.flatnonzero(~np.isnan(ratings[:, t]))
+        N = len(rows)
+        if N == 0:
+            continue
+        draws = rng.integers(0, N, (size, N))
+        weights = np.bincount((draws + N * np.arange(size)[:, None]).ravel(), minlength=size * N)
+        weights = weights.reshape(size, N).astype(np.float64)
+        # sum w r x - (sum w r)(sum w x) / N is the centered cross-product of the drawn rows
+        r, x = ratings[rows, t], coords[rows]
+        models[:, t] = (weights * r) @ x - (weights @ r)[:, None] * (weights @ x) / N
+    reference = np.tile(observed, (size, 1))
+    return normalizeModels(models.reshape(size * T, -1), normalization, reference).reshape(models.shape)
+
+# runs fn(seed, size, *args) for every batch in a pool of `processes` workers (or in this
+# process if processes is 1); yields the results in batch order
+def _runBatches(fn, args, ratings, coords, count, seed, processes, batchSize):
+    sizes = [min(batchSize, count - start) for start in range(0, count, batchSize)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    blocks = []
+    try:
+        if processes is None or processes > 1:
+            ratingsBlock, ratingsInfo = _share(ratings)
+            blocks.append(ratingsBlock)
+            coordsBlock, coordsInfo = _share(coords)
+            blocks.append(coordsBlock)
+            with ProcessPoolExecutor(processes, initializer=_attach, initargs=(ratingsInfo, coordsInfo)) as executor:
+                yield from executor.map(fn, seeds, sizes, *[[arg] * len(sizes) for arg in args])
+        else:
+            _shared['ratings'], _shared['coords'] = ratings, coords
+            for childSeed, size in zip(seeds, sizes):
+                yield fn(childSeed, size, *args)
+    finally:
+        _shared.clear()
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+# returns (N, T) ratings centered on every trait's own rated faces (NaN where missing), (N, 100)
+# coords and the (T, 100) observed cross-products, the same as ModelBuilder.crossprod
+def _prepare(ratings, coords):
+    ratings = np.array(ratings, dtype=np.float64)
+    if ratings.ndim == 1:
+        ratings = ratings[:, None]
+    coords = np.asarray(symmetricCoords(coords), dtype=np.float64)
+    rated = ~np.isnan(ratings)
+    ratings -= np.where(rated, ratings, 0).sum(axis=0) / np.maximum(rated.sum(axis=0), 1)
+    return ratings, coords, np.where(rated, ratings, 0).T @ coords
+
+# Permutation test of every model coordinate: the ratings of every trait are shuffled across its
+# rated faces nPermutations times; returns (observed (T, 100) models, two-sided (T, 100) p-values)
+def permutationTest(ratings, coords, nPermutations=1000, normalization='split', seed=None,
+                    processes=None, batchSize=RESAMPLING_BATCH):
+    ratings, coords, crossprod = _prepare(ratings, coords)
+    observed = normalizeModels(crossprod, normalization)
+    exceed = np.zeros(observed.shape)
+    for counts in _runBatches(_permutationBatch, (crossprod, ), ratings, coords,
+                              nPermutations, seed, processes, batchSize):
+        exceed += counts
+    return observed, (exceed + 1) / (nPermutations + 1)
+
+# Percentile bootstrap of every model coordinate over nBootstraps resamples of the rated faces,
+# every resample scaled by the norms of the observed model; returns (observed (T, 100) models,
+# lower (T, 100) and upper (T, 100) bounds of the 1 - alpha interval)
+def bootstrapCI(ratings, coords, nBootstraps=1000, alpha=0.05, normalization='split', seed=None,
+                processes=None, batchSize=RESAMPLING_BATCH):
+    ratings, coords, crossprod = _prepare(ratings, coords)
+    observed = normalizeModels(crossprod, normalization)
+    models = np.concatenate(list(_runBatches(_bootstrapBatch, (crossprod, normalization), ratings, coords,
+                                             nBootstraps, seed, processes, batchSize)))
+    lower, upper = np.quantile(models, [alpha / 2, 1 - alpha / 2], axis=0)
+    return observed, lower, upper
+
+# writes one row per trait and coordinate: trait, coordinate (D1..D100), model value, lower and
+# upper bound and p-value (empty when not computed)
+def writeSignificanceCsv(fileName, traits, models, lower=None, upper=None, pValues=None):
+    empty = np.full(np.shape(models), np.nan)
+    columns = [np.asarray(c) if c is not None else empty for c in (models, lower, upper, pValues)]
+    with open(fileName, 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(['trait', 'coordinate', 'model', 'lower', 'upper', 'p'])
+        for t, trait in enumerate(traits):
+            for d in range(columns[0].shape[1]):
+                writer.writerow([trait, 'D%i' % (d + 1)] + ['' if np.isnan(c[t, d]) else repr(float(c[t, d])) for c in columns])
@@ -0,0 +1,353 @@
+# Parallel job runner for FaceGen SDK command line pipelines (fg3, fgbl, fg3pf)
+# by DongWon Oh (dongwonohphd@gmail.com)
+#
+# A pipeline is a list of stages, each one SDK call given as an argv list, plus the files to
+# keep once all stages succeeded. Every input file becomes a job that runs in its own
+# temporary directory (so intermediate files of concurrent jobs never collide), with a
+# bounded number of jobs running at the same time, a timeout and retries per stage, and a
+# JSON summary of the status and timings of every job.
+#
+# Stage arguments may contain these placeholders:
+#   {input}  absolute path of the input file
+#   {name}   file name of the input, which is linked into the job directory under that name
+#   {base}   file name of the input without its extension
+#   {model}  model directory (e.g. ~/sdk/data/csam/Animate/Head/HeadHires)
+# Stages run with the job directory as working directory, so relative paths refer to it.
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import hashlib
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MODEL = os.path.expanduser("~/sdk/data/csam/Animate/Head/HeadHires")
+
+# outputs lists the files (templates relative to the job directory) a stage creates; only
+# stages with outputs can be served from an ArtifactCache. byName marks stages that write file
+# names of the job into their outputs (a .dae refers to its colour map by name), whose cached
+# outputs can therefore only be reused for inputs of the same name.
+class Stage:
+
+    def __init__(self, name, argv, outputs=(), timeout=None, byName=False):
+        self.name = name
+        self.argv = list(argv)
+        self.outputs = list(outputs)
+        self.timeout = timeout
+        self.byName = byName
+
+class Pipeline:
+
+    # results are (file in the job directory, file name in the output directory) template pairs
+    def __init__(self, name, stages, results):
+        self.name = name
+        self.stages = list(stages)
+        self.results = list(results)
+
+FG2DAE = Pipeline('fg2dae', [
+    Stage('mesh', ['fg3', 'apply', 'ssm', '{model}', '{name}', '{base}.fgmesh'], ['{base}.fgmesh']),
+    Stage('colour map', ['fg3', 'apply', 'scm', '{model}', '{name}', '{base}.jpg'], ['{base}.jpg']),
+    Stage('dae', ['fgbl', 'mesh', 'export', '{base}.dae', '{base}.fgmesh', '{base}.jpg'], ['{base}.dae'], byName=True),
+], [('{base}.fgmesh', '{base}.fgmesh'), ('{base}.jpg', '{base}.jpg'), ('{base}.dae', '{base}.dae')])
+
+JPG2FG = Pipeline('jpg2fg', [
+    Stage('landmarks', ['fg3pf', 'lms', '{name}'], ['{name}.lms.txt']),
+    Stage('photofit', ['fg3pf', 'photofit', '{base}.fg', '{name}'], ['{base}.fg']),
+], [('{base}.fg', '{base}.fg')])
+
+FG2JPG = Pipeline('fg2jpg', [
+    Stage('mesh', ['fg3', 'apply', 'ssm', '{model}', '{name}', 'head.tri'], ['head.tri']),
+    Stage('colour map', ['fg3', 'apply', 'scm', '{model}', '{name}', 'head.jpg'], ['head.jpg']),
+    Stage('expression', ['fgbl', 'morph', 'anim', 'RestingExpression', 'head.tri', 'Expression SmileOpen', '0'],
+          ['headRestingExpression.tri']),
+    Stage('render setup', ['fgbl', 'render', 'setup', 'render.txt', 'headRestingExpression.tri', 'head.jpg'],
+          ['render.txt']),
+    Stage('render', ['fgbl', 'render', 'run', 'render.txt', 'render.jpg'], ['render.jpg']),
+], [('render.jpg', '{base}.jpg')])
+
+# On-disk cache of stage outputs. An entry is keyed by the hash of the job's input file, the
+# model directory and the commands of the stage and all stages before it, so a stage is only
+# skipped when everything it depends on is unchanged. Cached files are stored read-only under
+# their position in the stage's outputs, so the same content under another file name is a hit,
+# and restored into the job directory by hard link (copied when linking is not possible) under
+# the job's file names. Results leave the job directory as copies, never as links into the
+# cache. Once the cache grows beyond maxBytes the least recently used entries are evicted down
+# to lowWater (a fraction of maxBytes), so eviction runs in occasional batches. Entries are
+# tracked in an in-memory LRU index, built from one scan of the cache directory when it opens.
+class ArtifactCache:
+
+    def __init__(self, cacheDir, maxBytes=10 * 1024 ** 3, lowWater=0.9):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.lowWater = lowWater
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cacheDir, exist_ok=True)
+        # key -> size in bytes of every entry, least recently used first
+        self._lru = OrderedDict((os.path.basename(path), size) for _, path, size in sorted(self._entries()))
+        self.size = sum(self._lru.values())
+
+    @staticmethod
+    def hashFile(fileName):
+        digest = hashlib.sha256()
+        with open(fileName, 'rb') as source:
+            for block in iter(lambda: source.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    # key of a stage given the input hash, the model directory and the argv templates of the
+    # stage and the stages before it; name is the input file name for stages keyed by name
+    @staticmethod
+    def stageKey(inputHash, model, commands, name=None):
+        digest = hashlib.sha256(inputHash.encode())
+        digest.update(b'\0' + os.path.abspath(model).encode())
+        for argv in commands:
+            digest.update(b'\0' + '\x1f'.join(argv).encode())
+        if name is not None:
+            digest.update(b'\0\0' + name.encode())
+        return digest.hexdigest()
+
+    def _entryDir(self, key):
+        return os.path.join(self.cacheDir, key[:2], key)
+
+    # (last use, path, size in bytes) of every entry
+    def _entries(self):
+        for prefix in os.scandir(self.cacheDir):
+            if not prefix.is_dir() or len(prefix.name) != 2:
+                continue
+            for entry in os.scandir(prefix.path):
+                if entry.is_dir():
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                    yield entry.stat().st_mtime, entry.path, size
+
+    # restores the cached files of a key into directory under fileNames, returns False on a
+    # cache miss (also when the entry is evicted while it is being restored)
+    def fetch(self, key, fileNames, directory):
+        entryDir = self._entryDir(key)
+        targets = [os.path.join(directory, f) for f in fileNames]
+        try:
+            for i, target in enumerate(targets):
+                if os.path.exists(target):
+                    os.remove(target)
+                try:
+                    os.link(os.path.join(entryDir, str(i)), target)
+                except FileNotFoundError:
+                    raise
+                except OSError:
+                    shutil.copyfile(os.path.join(entryDir, str(i)), target)
+            os.utime(entryDir)
+        except FileNotFoundError:
+            for target in targets:
+                if os.path.exists(target):
+                    os.remove(target)
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+            if key in self._lru:
+                self._lru.move_to_end(key)
+        return True
+
+    # copies files from directory into the cache under key
+    def store(self, key, fileNames, directory):
+        entryDir = self._entryDir(key)
+        if os.path.exists(entryDir):
+            return
+        os.makedirs(os.path.dirname(entryDir), exist_ok=True)
+        stagingDir = tempfile.mkdtemp(prefix='.store-', dir=self.cacheDir)
+        size = 0
+        for i, f in enumerate(fileNames):
+            cached = os.path.join(stagingDir, str(i))
+            shutil.copyfile(os.path.join(directory, f), cached)
+            os.chmod(cached, 0o444)
+            size += os.path.getsize(cached)
+        try:
+            os.rename(stagingDir, entryDir)
+        except OSError:
+            # another job stored the same entry first
+            shutil.rmtree(stagingDir, ignore_errors=True)
+            return
+        with self._lock:
+            self._lru[key] = size
+            self.size += size
+        if self.size > self.maxBytes:
+            self.evict()
+
+    # removes least recently used entries until the cache is down to lowWater * maxBytes; the
+    # entries are taken off the index under the lock and deleted outside of it
+    def evict(self):
+        victims = []
+        with self._lock:
+            while self._lru and self.size > self.lowWater * self.maxBytes:
+                key, size = self._lru.popitem(last=False)
+                self.size -= size
+                victims.append(key)
+        for key in victims:
+            shutil.rmtree(self._entryDir(key), ignore_errors=True)
+
+# finds an SDK executable in sdkDir, falling back to the system PATH
+def _executable(name, sdkDir=None):
+    if sdkDir:
+        for candidate in (name, name + '.exe'):
+            path = os.path.join(sdkDir, candidate)
+            if os.path.isfile(path):
+                return os.path.abspath(path)
+    return shutil.which(name) or name
+
+def _linkInto(source, target):
+    try:
+        os.symlink(os.path.abspath(source), target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+def _runStage(stage, fields, jobDir, retries, sdkDir, timeout):
+    argv = [_executable(stage.argv[0], sdkDir)] + [arg.format(**fields) for arg in stage.argv[1:]]
+    timeout = stage.timeout or timeout
+    record = {'stage': stage.name, 'argv': argv, 'attempts': 0}
+    start = time.time()
+    for _ in range(retries + 1):
+        record['attempts'] += 1
+        try:
+            result = subprocess.run(argv, cwd=jobDir, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    timeout=timeout)
+            record['returncode'] = result.returncode
+            record['stderr'] = result.stderr.decode('utf-8', 'replace')[-2000:]
+            if result.returncode == 0:
+                break
+        except subprocess.TimeoutExpired:
+            record['returncode'] = None
+            record['stderr'] = "timed out after %s seconds" % timeout
+        except OSError as e:
+            record['returncode'] = None
+            record['stderr'] = str(e)
+            break
+    record['seconds'] = round(time.time() - start, 3)
+    record['ok'] = record['returncode'] == 0
+    return record
+
+# runs all stages of a pipeline for one input file, returns the job's status record; timeout
+# applies to stages that do not set their own, retries is the number of reruns of a failing stage
+# cache is an optional ArtifactCache serving stages whose inputs are unchanged. Errors of a job
+# (e.g. moving its results into outputDir) are recorded in its status instead of raised.
+def runJob(pipeline, inputFile, outputDir, model=DEFAULT_MODEL, retries=0, timeout=None, sdkDir=None,
+           workDir=None, keepTemp=False, cache=None):
+    name = os.path.basename(inputFile)
+    fields = {'input': os.path.abspath(inputFile), 'name': name,
+              'base': os.path.splitext(name)[0], 'model': model}
+    status = {'input': inputFile, 'ok': False, 'stages': []}
+    start = time.time()
+    jobDir = tempfile.mkdtemp(prefix='fgjob-', dir=workDir)
+    try:
+        _linkInto(inputFile, os.path.join(jobDir, name))
+        inputHash = ArtifactCache.hashFile(inputFile) if cache else None
+        for i, stage in enumerate(pipeline.stages):
+            outputs = [output.format(**fields) for output in stage.outputs]
+            key = None
+            if cache and outputs:
+                byName = any(s.byName for s in pipeline.stages[:i + 1])
+                key = ArtifactCache.stageKey(inputHash, model, [s.argv for s in pipeline.stages[:i + 1]],
+                                             name if byName else None)
+                if cache.fetch(key, outputs, jobDir):
+                    status['stages'].append({'stage': stage.name, 'ok': True, 'cached': True, 'seconds': 0.0})
+                    continue
+            record = _runStage(stage, fields, jobDir, retries, sdkDir, timeout)
+            status['stages'].append(record)
+            if record['ok'] and key and all(os.path.exists(os.path.join(jobDir, f)) for f in outputs):
+                cache.store(key, outputs, jobDir)
+            if not record['ok']:
+                status['error'] = "%s failed: %s" % (stage.name, record['stderr'].strip())
+                break
+        else:
+            outputs = []
+            for source, target in pipeline.results:
+                source = os.path.join(jobDir, source.format(**fields))
+                if not os.path.exists(source):
+                    status['error'] = "missing output %s" % os.path.basename(source)
+                    break
+                outputs.append((source, os.path.join(outputDir, target.format(**fields))))
+            else:
+                for source, target in outputs:
+                    if os.path.exists(target):
+                        os.remove(target)
+                    if os.stat(source).st_nlink > 1:
+                        # restored from the cache: copy, so the result is not a link to the entry
+                        shutil.copyfile(source, target)
+                    else:
+                        shutil.move(source, target)
+                status['outputs'] = [target for _, target in outputs]
+                status['ok'] = True
+    except Exception as e:
+        status['ok'] = False
+        status['error'] = "%s: %s" % (type(e).__name__, e)
+    finally:
+        if keepTemp:
+            status['jobDir'] = jobDir
+        else:
+            shutil.rmtree(jobDir, ignore_errors=True)
+    status['seconds'] = round(time.time() - start, 3)
+    return status
+
+# runs a pipeline over many input files with at most `jobs` jobs at a time, prints progress and
+# optionally writes a JSON summary; returns the list of job status records
+def runJobs(pipeline, inputFiles, outputDir, jobs=1, summaryFile=None, **options):
+    os.makedirs(outputDir, exist_ok=True)
+    start = time.time()
+
+    def run(inputFile):
+        try:
+            status = runJob(pipeline, inputFile, outputDir, **options)
+        except Exception as e:
+            # e.g. no job directory could be created; the rest of the batch still runs
+            status = {'input': inputFile, 'ok': False, 'stages': [], 'error': "%s: %s" % (type(e).__name__, e)}
+        if status['ok']:
+            print("Successfully converted %s" % inputFile)
+        else:
+            print("Error converting %s: %s" % (inputFile, status.get('error', '')))
+        return status
+
+    with ThreadPoolExecutor(max(1, jobs)) as pool:
+        statuses = list(pool.map(run, inputFiles))
+
+    if summaryFile:
+        summary = {'pipeline': pipeline.name, 'jobs': statuses,
+                   'ok': sum(status['ok'] for status in statuses),
+                   'failed': sum(not status['ok'] for status in statuses),
+                   'seconds': round(time.time() - start, 3)}
+        with open(summaryFile, 'w') as out:
+            json.dump(summary, out, indent=2)
+    return statuses
+
+# command line entry point shared by the batch conversion scripts:
+#   script <input-dir> <output-dir> [jobs]
+# SDK executables are looked up in $FG_SDK_DIR (default: the script's own directory, i.e. the
+# SDK bin folder when the script is placed there) and then on the PATH; the model directory
+# can be set with $FG_MODEL_DIR. Setting $FG_CACHE_DIR reuses stage outputs of unchanged inputs
+# from an ArtifactCache in that directory, limited to $FG_CACHE_MB megabytes (default 10240).
+def main(pipeline, extension, argv=None):
+    argv = sys.argv if argv is None else argv
+    if len(argv) not in (3, 4):
+        print("Usage: python %s.py [input-dir] [output-dir] [jobs]" % pipeline.name)
+        sys.exit(1)
+
+    inputDir, outputDir = argv[1], argv[2]
+    jobs = int(argv[3]) if len(argv) > 3 else 1
+    if not os.path.exists(inputDir):
+        print("Error: input directory %s does not exist." % inputDir)
+        sys.exit(1)
+
+    inputFiles = [os.path.join(inputDir, f) for f in sorted(os.listdir(inputDir)) if f.endswith(extension)]
+    summaryFile = os.path.join(outputDir, '%s-summary.json' % pipeline.name)
+    cache = None
+    if os.environ.get('FG_CACHE_DIR'):
+        cache = ArtifactCache(os.environ['FG_CACHE_DIR'], int(os.environ.get('FG_CACHE_MB', 10240)) * 1024 ** 2)
+    statuses = runJobs(pipeline, inputFiles, outputDir, jobs, summaryFile, cache=cache,
+                       model=os.environ.get('FG_MODEL_DIR', DEFAULT_MODEL),
+                       sdkDir=os.environ.get('FG_SDK_DIR', os.path.dirname(os.path.abspath(argv[0]))))
+    print("Done: %i converted, %i failed. Summary in %s" % (sum(s['ok'] for s in statuses),
+                                                           sum(not s['ok'] for s in statuses), summaryFile))
@@ -0,0 +1,188 @@
+# Nearest-neighbour search over large collections of FaceGen faces
+# by DongWon Oh (dongwonohphd@gmail.com)
+#
+# FaceIndex holds the coordinates of a face collection as one float32 matrix and answers
+# k-nearest-neighbour, radius and near-duplicate queries with blocked matrix products:
+#   |q - x|^2 = |q|^2 + |x|^2 - 2 q.x     (euclidean)
+#   1 - q.x / (|q| |x|)                  (cosine)
+# so a block of queries against a block of faces is one BLAS call, and only the best
+# candidates of each block are kept, never an N x N matrix. The coordinates are centered
+# before they are stored, which keeps the float32 expansion accurate; the distances of the
+# candidates that are returned are recomputed exactly in float64.
+#
+# The face spaces have 30 to 130 dimensions, where space-partitioning trees do not beat a
+# blocked scan, so there is no tree index.
+
+import numpy as np
+from FGBinTools import readFGBatch, FG_SLICES, FG_NCOORDS
+from CorpusTools import FGCorpus
+
+# columns of (N, 130) .fg coordinates that make up each searchable space
+FACE_SPACES = {
+    'SS': FG_SLICES['SS'],
+    'SA': FG_SLICES['SA'],
+    'TS': FG_SLICES['TS'],
+    'sym': np.r_[FG_SLICES['SS'], FG_SLICES['TS']],
+    'all': slice(0, FG_NCOORDS),
+}
+
+# columns of (N, 100) SS | TS coordinates for the spaces they contain
+SYM_SPACES = {'SS': slice(0, 50), 'TS': slice(50, 100), 'sym': slice(0, 100)}
+
+class FaceIndex:
+
+    # names and (N, 130) .fg coordinates (or (N, 100) SS | TS coordinates) of the indexed faces;
+    # space is 'SS', 'SA', 'TS', 'sym' (SS and TS) or 'all', metric 'euclidean' or 'cosine'
+    def __init__(self, names, coords, space='sym', metric='euclidean', blockSize=4096):
+        if metric not in ('euclidean', 'cosine'):
+            raise ValueError("Unknown metric: %s" % metric)
+        if space not in FACE_SPACES:
+            raise ValueError("Unknown face space: %s" % space)
+        self.names = list(names)
+        self.space = space
+        self.metric = metric
+        self.blockSize = blockSize
+
+        exact = self._select(coords)
+        if len(exact) != len(self.names):
+            raise ValueError("Expected one name per row of coordinates.")
+        self.center = exact.mean(axis=0) if metric == 'euclidean' and len(exact) else np.zeros(exact.shape[1])
+        self.exact = exact - self.center
+        if metric == 'cosine':
+            norms = np.linalg.norm(self.exact, axis=1, keepdims=True)
+            self.exact /= np.where(norms == 0, 1, norms)
+        self.data = self.exact.astype(np.float32)
+        self.norms = np.einsum('ij,ij->i', self.data, self.data)
+
+    @classmethod
+    def fromFG(cls, FGFileNames, space='sym', metric='euclidean', threads=None):
+        names, coords = readFGBatch(FGFileNames, threads)
+        return cls(names, coords, space, metric)
+
+    # corpus is an FGCorpus or the name of a corpus file
+    @classmethod
+    def fromCorpus(cls, corpus, space='sym', metric='euclidean'):
+        if not isinstance(corpus, FGCorpus):
+            corpus = FGCorpus(corpus)
+        return cls(corpus.names, corpus.coords, space, metric)
+
+    def __len__(self):
+        return len(self.names)
+
+    # float64 columns of the index space from (Q, 130) or (Q, 100) SS | TS coordinates
+    def _select(self, coords):
+        coords = np.atleast_2d(np.asarray(coords, dtype=np.float64))
+        if coords.shape[1] == FG_NCOORDS:
+            return coords[:, FACE_SPACES[self.space]]
+        if coords.shape[1] == 100 and self.space in SYM_SPACES:
+            return coords[:, SYM_SPACES[self.space]]
+        raise ValueError("Coordinates with %i columns do not contain the %s space." % (coords.shape[1], self.space))
+
+    # queries in index space, centered (euclidean) or unit length (cosine) like the data
+    def _prepare(self, coords):
+        queries = self._select(coords) - self.center
+        if self.metric == 'cosine':
+            norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            queries /= np.where(norms == 0, 1, norms)
+        return queries
+
+    # approximate (q, n) float32 scores of a query block against a block of faces: squared
+    # distances (euclidean) or distances (cosine), both ordered like the distances
+    def _blockScores(self, queries, queryNorms, start, stop):
+        products = queries @ self.data[start:stop].T
+        if self.metric == 'cosine':
+            return np.subtract(1, products, out=products)
+        products *= -2
+        products += queryNorms[:, None]
+        products += self.norms[None, start:stop]
+        return products
+
+    # exact float64 distances between query rows and the faces in rows (same shape as rows)
+    def _exactDistances(self, queries, rows):
+        if self.metric == 'cosine':
+            return np.maximum(1 - np.einsum('qd,qkd->qk', queries, self.exact[rows]), 0)
+        return np.linalg.norm(queries[:, None, :] - self.exact[rows], axis=2)
+
+    def _blocks(self, queries):
+        queries32 = queries.astype(np.float32)
+        queryNorms = np.einsum('ij,ij->i', queries32, queries32)
+        for qStart in range(0, len(queries), self.blockSize):
+            q = slice(qStart, qStart + self.blockSize)
+            yield q, queries32[q], queryNorms[q]
+
+    # k nearest faces of every query row; returns ((Q, k) indices, (Q, k) distances), nearest first
+    def query(self, coords, k=1):
+        queries = self._prepare(coords)
+        k = min(k, len(self))
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        distances = np.empty((len(queries), k))
+        for q, block, blockNorms in self._blocks(queries):
+            bestRows = np.empty((len(block), 0), dtype=np.int64)
+            bestScores = np.empty((len(block), 0), dtype=np.float32)
+            for start in range(0, len(self), self.blockSize):
+                stop = min(start + self.blockSize, len(self))
+                candidates = np.concatenate([bestScores, self._blockScores(block, blockNorms, start, stop)], axis=1)
+                rows = np.concatenate([bestRows, np.broadcast_to(np.arange(start, stop), (len(block), stop - start))], axis=1)
+                if candidates.shape[1] > k:
+                    keep = np.argpartition(candidates, k - 1, axis=1)[:, :k]
+                    candidates = np.take_along_axis(candidates, keep, axis=1)
+                    rows = np.take_along_axis(rows, keep, axis=1)
+                bestScores, bestRows = candidates, rows
+
+            exact = self._exactDistances(queries[q], bestRows)
+            order = np.argsort(exact, axis=1, kind='stable')
+            indices[q] = np.take_along_axis(bestRows, order, axis=1)
+            distances[q] = np.take_along_axis(exact, order, axis=1)
+        return indices, distances
+
+    # bound on the float32 scores of faces within radius, with slack so that no face within the
+    # radius is missed before the exact check
+    def _bound(self, radius):
+        if self.metric == 'cosine':
+            return radius + 1e-5
+        return (radius + 1e-3 * (1 + np.sqrt(self.norms.max(initial=0)))) ** 2
+
+    # faces within radius of every query row; returns a list of (indices, distances) per query,
+    # nearest first
+    def radius(self, coords, radius):
+        queries = self._prepare(coords)
+        bound = self._bound(radius)
+        results = []
+        for q, block, blockNorms in self._blocks(queries):
+            found = [[] for _ in range(len(block))]
+            for start in range(0, len(self), self.blockSize):
+                stop = min(start + self.blockSize, len(self))
+                hits = np.nonzero(self._blockScores(block, blockNorms, start, stop) <= bound)
+                for row, column in zip(*hits):
+                    found[row].append(start + column)
+            for query, rows in zip(queries[q], found):
+                rows = np.array(rows, dtype=np.int64)
+                exact = self._exactDistances(query[None], rows[None])[0]
+                keep = exact <= radius
+                order = np.argsort(exact[keep], kind='stable')
+                results.append((rows[keep][order], exact[keep][order]))
+        return results
+
+    # all pairs of indexed faces within threshold of each other; returns (P, 2) index pairs (i < j)
+    # and their (P, ) distances, sorted by distance
+    def duplicates(self, threshold=0.0):
+        bound = self._bound(threshold)
+        pairs = []
+        for qStart in range(0, len(self), self.blockSize):
+            qStop = min(qStart + self.blockSize, len(self))
+            block = self.data[qStart:qStop]
+            for start in range(qStart, len(self), self.blockSize):
+                stop = min(start + self.blockSize, len(self))
+                rows, columns = np.nonzero(self._blockScores(block, self.norms[qStart:qStop], start, stop) <= bound)
+                rows, columns = rows + qStart, columns + start
+                upper = rows < columns
+                pairs.append(np.stack([rows[upper], columns[upper]], axis=1))
+
+        pairs = np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=np.int64)
+        if self.metric == 'cosine':
+            exact = np.maximum(1 - np.einsum('pd,pd->p', self.exact[pairs[:, 0]], self.exact[pairs[:, 1]]), 0)
+        else:
+            exact = np.linalg.norm(self.exact[pairs[:, 0]] - self.exact[pairs[:, 1]], axis=1)
+        keep = exact <= threshold
+        order = np.argsort(exact[keep], kind='stable')
+        return pairs[keep][order], exact[keep][order]
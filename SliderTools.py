@@ -0,0 +1,120 @@
+# Evaluating and setting the linear controls (sliders) of a control file on batches of faces
+# by DongWon Oh (dongwonohphd@gmail.com)
+#
+# The GS, GA and TS sections of a .ctl file are (sliders x coordinates) matrices L over the SS,
+# SA and TS coordinates of a face, and the value of every slider of a section is L c with c the
+# face's coordinates in SD units (.fg values / 1000). For N faces that is one (N, coords) x
+# (coords, sliders) product per section.
+#
+# Setting sliders finds the smallest coordinate change dc with
+#   L_changed dc = delta   (the requested change of the chosen sliders)
+#   L_fixed   dc = 0       (every other slider of the section, or a given subset)
+# which is the same (coords, sliders) matrix for every face. When there are more sliders than
+# coordinates (si.ctl has 61 GS sliders for 50 SS coordinates) the fixed sliders cannot all
+# stay in place; the chosen sliders are then still set exactly and the change of the fixed
+# ones is made as small as possible (least squares in the null space of L_changed).
+
+import numpy as np
+from FGBinTools import CtlFile, loadCtl, readFGBatch, writeFGBatch, FG_SLICES, FG_NCOORDS, FG_COORD_SCALE
+
+# coordinate section of the face that the sliders of each control section act on
+CTL_COORDS = {'GS': 'SS', 'GA': 'SA', 'TS': 'TS'}
+
+class SliderEngine:
+
+    # ctl is a CtlFile or the name of a control file
+    def __init__(self, ctl):
+        if not isinstance(ctl, CtlFile):
+            ctl = loadCtl(ctl)
+        self.ctl = ctl
+        self.sections = [section for section in CTL_COORDS if len(ctl.labels[section]) and ctl.nCoords[section]]
+        self.matrices = {section: np.asarray(ctl.sections[section], dtype=np.float64) for section in self.sections}
+
+    def labels(self, section):
+        return self.ctl.labels[section]
+
+    # checks sections (None for all) against the sections with sliders on face coordinates
+    def _sections(self, sections):
+        if sections is None:
+            return self.sections
+        invalid = [section for section in sections if section not in self.sections]
+        if invalid:
+            raise ValueError("No sliders on face coordinates in section %s; valid sections are %s."
+                             % (', '.join(invalid), ', '.join(self.sections)))
+        return list(sections)
+
+    # the (N, width) SD-unit coordinates of a section's sliders, from (N, 130) .fg coordinates
+    def _coords(self, coords, section):
+        columns = np.asarray(coords, dtype=np.float64)[:, FG_SLICES[CTL_COORDS[section]]]
+        return columns[:, :self.ctl.nCoords[section]] / FG_COORD_SCALE
+
+    # returns {section: (N, sliders) values} of all sliders, or of the given sections, for
+    # (N, 130) .fg coordinates
+    def evaluate(self, coords, sections=None):
+        coords = np.atleast_2d(coords)
+        return {section: self._coords(coords, section) @ self.matrices[section].T
+                for section in self._sections(sections)}
+
+    # returns the (N, len(labels)) values of the given sliders of one section
+    def values(self, coords, labels, section='GS'):
+        rows = [self.ctl.index[section][label] for label in labels]
+        return self._coords(np.atleast_2d(coords), section) @ self.matrices[section][rows].T
+
+    # (width, changed) map from slider changes to coordinate changes that keeps the fixed
+    # sliders (all other sliders of the section if fixed is None) where they are
+    def _solver(self, section, changed, fixed=None):
+        index = self.ctl.index[section]
+        if fixed is None:
+            fixed = [label for label in self.labels(section) if label not in changed]
+        fixed = [index[label] for label in fixed if label in index and label not in changed]
+        changedRows = self.matrices[section][[index[label] for label in changed]]
+        solver = np.linalg.pinv(changedRows)
+        if not fixed:
+            return solver
+
+        # move within the null space of the changed sliders to undo the change of the fixed ones
+        _, singular, vt = np.linalg.svd(changedRows)
+        rank = int((singular > singular.max(initial=0) * max(changedRows.shape) * np.finfo(float).eps).sum())
+        null = vt[rank:].T
+        fixedRows = self.matrices[section][fixed]
+        return solver - null @ (np.linalg.pinv(fixedRows @ null) @ (fixedRows @ solver))
+
+    # Changes sliders of (N, 130) .fg coordinates and returns the new float (N, 130) coordinates.
+    # values sets and deltas shifts sliders; both map slider labels to a number or an (N, ) array
+    # with one number per face. Every section (GS, GA, TS) that has a slider of that label is
+    # changed, unless sections are given. All changed sliders are solved for together, and
+    # fixed optionally limits the other sliders that are held in place.
+    def apply(self, coords, values=None, deltas=None, sections=None, fixed=None):
+        coords = np.array(np.atleast_2d(coords), dtype=np.float64)
+        values, deltas = values or {}, deltas or {}
+        for section in self._sections(sections):
+            changed = [label for label in list(values) + list(deltas) if label in self.ctl.index[section]]
+            if not changed:
+                continue
+            if len(set(changed)) != len(changed):
+                raise ValueError("Sliders cannot be set and shifted at the same time.")
+            current = self.values(coords, changed, section)
+            delta = np.column_stack([np.broadcast_to(np.asarray(values[label], dtype=np.float64), len(coords)) - current[:, i]
+                                     if label in values else
+                                     np.broadcast_to(np.asarray(deltas[label], dtype=np.float64), len(coords))
+                                     for i, label in enumerate(changed)])
+            step = delta @ self._solver(section, changed, fixed).T * FG_COORD_SCALE
+            columns = np.arange(FG_NCOORDS)[FG_SLICES[CTL_COORDS[section]]][:self.ctl.nCoords[section]]
+            coords[:, columns] += step
+        return coords
+
+    def set(self, coords, values, sections=None, fixed=None):
+        return self.apply(coords, values, None, sections, fixed)
+
+    def shift(self, coords, deltas, sections=None, fixed=None):
+        return self.apply(coords, None, deltas, sections, fixed)
+
+# sets and shifts sliders of .fg files and writes the results to new .fg files; see SliderEngine.apply
+def setSlidersFG(FGFileNames, outputFileNames, ctl, values=None, deltas=None, sections=None, fixed=None, threads=None):
+    FGFileNames = list(FGFileNames)
+    names, coords = readFGBatch(FGFileNames, threads)
+    if len(names) != len(FGFileNames):
+        print("Not all FG files could be read, no faces were written.")
+        return False
+    coords = SliderEngine(ctl).apply(coords, values, deltas, sections, fixed)
+    return writeFGBatch(outputFileNames, coords, threads)
@@ -0,0 +1,158 @@
+# Streaming statistics over large collections of FaceGen faces
+# by DongWon Oh (dongwonohphd@gmail.com)
+#
+# RunningStats keeps the count, mean and co-moment matrix of the SS | SA | TS | TA coordinates
+# seen so far. Chunks of faces are folded in with the pairwise update of Chan et al.,
+#   M2 = M2_a + M2_b + n_a n_b / n (mean_b - mean_a)(mean_b - mean_a)'
+# which stays accurate for any number of faces, and partial results of separate workers merge
+# with the same update. Memory only depends on the number of coordinates (130 x 130). The
+# principal components of a section are the eigenvectors of its block of the covariance,
+# which is exact rather than an approximation since the matrix is that small.
+
+import os
+import re
+import numpy as np
+from FGBinTools import readFGBatch, writeFG, FG_SLICES, FG_NCOORDS
+from CorpusTools import FGCorpus
+
+# name of the prototype of all faces; writePrototypes refuses a group of the same name
+ALL_FACES = '_all'
+
+class RunningStats:
+
+    def __init__(self, nCoords=FG_NCOORDS):
+        self.n = 0
+        self.mean = np.zeros(nCoords)
+        self.comoment = np.zeros((nCoords, nCoords))
+
+    # folds an (n, nCoords) chunk of coordinates into the statistics
+    def update(self, coords):
+        coords = np.asarray(coords, dtype=np.float64)
+        if len(coords) == 0:
+            return
+        mean = coords.mean(axis=0)
+        centered = coords - mean
+        self._merge(len(coords), mean, centered.T @ centered)
+
+    def merge(self, other):
+        self._merge(other.n, other.mean, other.comoment)
+
+    def _merge(self, n, mean, comoment):
+        if n == 0:
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.comoment += comoment + np.outer(delta, delta) * (self.n * n / total)
+        self.mean += delta * (n / total)
+        self.n = total
+
+    def covariance(self, ddof=1):
+        if self.n <= ddof:
+            return np.full(self.comoment.shape, np.nan)
+        return self.comoment / (self.n - ddof)
+
+    # principal components of a section ('SS', 'SA', 'TS' or 'all'); returns (eigenvalues,
+    # (k, width) components) sorted by decreasing variance, all components unless k is given
+    def pca(self, section='all', k=None):
+        columns = slice(None) if section == 'all' else FG_SLICES[section]
+        covariance = self.covariance()[columns, columns]
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        order = np.argsort(eigenvalues)[::-1][:k]
+        return eigenvalues[order], eigenvectors[:, order].T
+
+# returns a function that maps a face name to its group: the first group of a regular expression
+# (or the whole match), e.g. r'_id(\d+)' groups the faces by identity
+def keyFromName(pattern):
+    pattern = re.compile(pattern)
+    def key(name):
+        match = pattern.search(name)
+        if match is None:
+            return None
+        return match.group(1) if pattern.groups else match.group(0)
+    return key
+
+# RunningStats over all faces (total) and for every group of faces (groups). key maps a face
+# name to its group, or is a regular expression (see keyFromName); faces without a group only
+# count towards the total.
+class GroupedStats:
+
+    def __init__(self, key=None, nCoords=FG_NCOORDS):
+        self.key = keyFromName(key) if isinstance(key, str) else key
+        self.nCoords = nCoords
+        self.total = RunningStats(nCoords)
+        self.groups = {}
+
+    def update(self, names, coords):
+        coords = np.asarray(coords, dtype=np.float64)
+        self.total.update(coords)
+        if self.key is None:
+            return
+        rows = {}
+        for row, name in enumerate(names):
+            rows.setdefault(self.key(str(name)), []).append(row)
+        rows.pop(None, None)
+        for group, groupRows in rows.items():
+            self.groups.setdefault(group, RunningStats(self.nCoords)).update(coords[groupRows])
+
+    def merge(self, other):
+        self.total.merge(other.total)
+        for group, stats in other.groups.items():
+            self.groups.setdefault(group, RunningStats(self.nCoords)).merge(stats)
+
+    # saves the partial statistics to an .npz file so that runs over separate parts of a corpus
+    # can be merged later (see load)
+    def save(self, fileName):
+        groups = sorted(self.groups)
+        stats = [self.total] + [self.groups[group] for group in groups]
+        np.savez(fileName, kind=np.array('stats'), groups=np.array(groups, dtype=str),
+                 n=np.array([s.n for s in stats]), mean=np.array([s.mean for s in stats]),
+                 comoment=np.array([s.comoment for s in stats]))
+
+    # loads statistics saved with save; key is only needed to keep updating them
+    @classmethod
+    def load(cls, fileName, key=None):
+        with np.load(fileName, allow_pickle=False) as data:
+            if data['kind'] != 'stats':
+                raise ValueError("%s does not contain face statistics." % fileName)
+            stats = cls(key, data['mean'].shape[1])
+            for i, group in enumerate([None] + data['groups'].tolist()):
+                running = RunningStats(stats.nCoords)
+                running.n, running.mean, running.comoment = int(data['n'][i]), data['mean'][i], data['comoment'][i]
+                if group is None:
+                    stats.total = running
+                else:
+                    stats.groups[group] = running
+        return stats
+
+    # writes the average face of every group (<prefix><group>.fg) and of all faces (<prefix>_all.fg)
+    # as .fg files; returns the names of the written prototypes
+    def writePrototypes(self, directory, prefix=''):
+        if ALL_FACES in self.groups:
+            raise ValueError("A group named %s would overwrite the prototype of all faces." % ALL_FACES)
+        os.makedirs(directory, exist_ok=True)
+        prototypes = [(ALL_FACES, self.total)] + sorted(self.groups.items())
+        for group, stats in prototypes:
+            if stats.n == 0:
+                continue
+            coords = np.clip(np.rint(stats.mean), -32768, 32767).astype(int).tolist()
+            writeFG(os.path.join(directory, '%s%s.fg' % (prefix, group)),
+                    coords[FG_SLICES['SS']], coords[FG_SLICES['SA']], coords[FG_SLICES['TS']])
+        return [group for group, stats in prototypes if stats.n]
+
+# statistics over .fg files, read chunkSize files at a time
+def statsFromFG(FGFileNames, key=None, chunkSize=10000, threads=None):
+    stats = GroupedStats(key)
+    FGFileNames = list(FGFileNames)
+    for start in range(0, len(FGFileNames), chunkSize):
+        names, coords = readFGBatch(FGFileNames[start:start + chunkSize], threads)
+        stats.update(names, coords)
+    return stats
+
+# statistics over an FG corpus (an FGCorpus or the name of a corpus file), chunkSize faces at a time
+def statsFromCorpus(corpus, key=None, chunkSize=100000):
+    if not isinstance(corpus, FGCorpus):
+        corpus = FGCorpus(corpus)
+    stats = GroupedStats(key, corpus.nCoords)
+    for start in range(0, len(corpus), chunkSize):
+        stats.update(corpus.names[start:start + chunkSize], corpus.coords[start:start + chunkSize])
+    return stats
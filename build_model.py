@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import shutil
+import ModelTools
+import ResamplingTools
+
+BASE_CTL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'si.ctl')
+
+def print_usage():
+    print("Usage: python build_model.py [--norm=split|l2|max|none] <ratings_csv> <faces> <output> [trait1 trait2 ...]")
+    print("  <ratings_csv>: csv with a header, the face file name in the first column and one column per trait")
+    print("  <faces>: Directory of FG files, an FG corpus file or a .npz file written by fg2csv.py")
+    print("  <output>: Models csv, or a .ctl file to insert the models into as SS and TS sliders (created from si.ctl if it does not exist)")
+    print("  [trait1 trait2 ...]: Optional. Traits to build models for. Default is every rating column.")
+    print("  --norm: Model normalization for csv output. Default is split (unit shape and texture halves, as in si-todorov.csv).")
+    print("  --permutations=N, --bootstraps=N: Also write permutation p-values and 95% bootstrap intervals of every")
+    print("    model coordinate to <output>_significance.csv")
+    print("  --processes=N: Worker processes for the resampling. Default is one per CPU.")
+    print("  --seed=N: Seed of the resampling, results are reproducible for the same seed")
+
+def write_significance(ratings_file, faces, traits, output_file, normalization, options):
+    traits, ratings, coords = ModelTools.loadRatings(ratings_file, faces, traits)
+    resampling = {'normalization': normalization, 'seed': options['seed'], 'processes': options['processes']}
+    models, lower, upper, p_values = None, None, None, None
+    if options['permutations']:
+        models, p_values = ResamplingTools.permutationTest(ratings, coords, options['permutations'], **resampling)
+    if options['bootstraps']:
+        models, lower, upper = ResamplingTools.bootstrapCI(ratings, coords, options['bootstraps'], **resampling)
+    ResamplingTools.writeSignificanceCsv(output_file, traits, models, lower, upper, p_values)
+    print(f"Wrote significance of {len(traits)} models to {output_file}")
+
+def main():
+    normalization = 'split'
+    options = {'permutations': 0, 'bootstraps': 0, 'processes': None, 'seed': None}
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('--norm='):
+            normalization = arg.split('=', 1)[1]
+            normalization = None if normalization == 'none' else normalization
+        elif arg.startswith('--') and arg[2:].split('=', 1)[0] in options:
+            key, value = arg[2:].split('=', 1)
+            options[key] = int(value)
+        else:
+            args.append(arg)
+    if len(args) < 3 or normalization not in ('split', 'l2', 'max', None):
+        print_usage()
+        sys.exit(1)
+
+    ratings_file, faces, output_file = args[:3]
+    traits = args[3:] or None
+
+    try:
+        builder = ModelTools.buildModelsFromFiles(ratings_file, faces, traits)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if not builder.traits:
+        print(f"Error: {ratings_file} has no trait columns.")
+        sys.exit(1)
+    if builder.n.sum() == 0:
+        print(f"Error: no ratings of faces in {faces} were read from {ratings_file}.")
+        sys.exit(1)
+    print(f"Built {len(builder.traits)} models from {int(builder.n.max())} ratings")
+    if output_file.endswith('.ctl'):
+        if not os.path.exists(output_file):
+            shutil.copyfile(BASE_CTL, output_file)
+        ModelTools.writeModelsCtl(output_file, builder.traits, builder.crossprod())
+    else:
+        ModelTools.writeModelsCsv(output_file, builder.traits, builder.models(normalization))
+
+    if options['permutations'] or options['bootstraps']:
+        write_significance(ratings_file, faces, traits, os.path.splitext(output_file)[0] + '_significance.csv',
+                           normalization, options)
+
+    print("Done.")
+
+if __name__ == "__main__":
+    main()
@@ -3,18 +3,39 @@
 import sys
 import os
 import csv
-from FGBinTools import insertSlider
+import shutil
+from FGBinTools import CtlWriter, loadControls
 from LinAlgTools import normalize
 from numpy import array
 
+# control file that new output files start from
+BASE_CTL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'si.ctl')
+
 def print_usage():
     print("Usage: python csv2ctl.py <input_csv> <output_ctl> [controls_file]")
-    print("  <input_csv>: Path to input CSV file or directory containing CSV files")
+    print("  <input_csv>: Path to input CSV file or directory containing CSV files; .npz files written by")
+    print("               ctl2csv.py are accepted too and their weights are copied without renormalizing")
     print("  <output_ctl>: Path to output CTL file or directory")
     print("  [controls_file]: Optional. Path to file containing list of controls to convert")
+    print("  Sliders are added to <output_ctl> if it exists, otherwise to a copy of si.ctl")
 
 def process_csv(csv_file, ctl_file, controls=None):
-    with open(csv_file, 'r') as source, open(ctl_file, 'w') as ctlfile:
+    if not os.path.exists(ctl_file):
+        shutil.copyfile(BASE_CTL, ctl_file)
+
+    writer = CtlWriter(ctl_file)
+    if csv_file.endswith('.npz'):
+        for label, SS, TS in zip(*loadControls(csv_file)):
+            if controls and label not in controls:
+                continue
+            print(f"Processing: {label}")
+            writer.add(str(label), SS, 'SS')
+            writer.add(str(label), TS, 'TS')
+        if not writer.commit():
+            print(f"Error: no sliders written to {ctl_file}")
+        return
+
+    with open(csv_file, 'r') as source:
         csv_reader = csv.reader(source)
         header = next(csv_reader)
         
@@ -28,8 +49,11 @@ def process_csv(csv_file, ctl_file, controls=None):
             SS = normalize(array([float(i) for i in line[1:51]]))
             TS = normalize(array([float(i) for i in line[51:101]]))
             
-            insertSlider(label, SS.tolist(), 'SS', ctlfile)
-            insertSlider(label, TS.tolist(), 'TS', ctlfile)
+            writer.add(label, SS, 'SS')
+            writer.add(label, TS, 'TS')
+
+    if not writer.commit():
+        print(f"Error: no sliders written to {ctl_file}")
 
 def main():
     if len(sys.argv) < 3:
@@ -48,9 +72,9 @@ def main():
     if os.path.isdir(input_path):
         os.makedirs(output_path, exist_ok=True)
         for filename in os.listdir(input_path):
-            if filename.endswith('.csv'):
+            if filename.endswith('.csv') or filename.endswith('.npz'):
                 csv_file = os.path.join(input_path, filename)
-                ctl_file = os.path.join(output_path, filename.replace('.csv', '.ctl'))
+                ctl_file = os.path.join(output_path, os.path.splitext(filename)[0] + '.ctl')
                 process_csv(csv_file, ctl_file, controls)
     else:
         process_csv(input_path, output_path, controls)
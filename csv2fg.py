@@ -18,36 +18,45 @@ import sys
 import csv
 import shutil
 import os
-from FGBinTools import writeFG
+import numpy as np
+from FGBinTools import writeFGBatch, loadFaces
+from ArchiveTools import isArchive, writeArchiveFG
 
 # For the 130 parameter-long csv: First column is the name of the fg file, the 50 coulumns after are the symmetric shape values, 30 asymmetric shape values, and 50 symmetric texture values.
 # For the 100 parameter-long csv: First column is the name of the fg file, the 50 coulumns after are the symmetric shape values and 50 symmetric texture values.
+# A .npz file written by fg2csv.py holds the names and all 130 coordinates, num_parameters is ignored for it.
 
 def print_usage():
-    print("Usage: python csv2fg.py <face_file.csv> [num_parameters] [output_path]")
-    print("  <face_file.csv>: Path to the CSV file containing face data")
+    print("Usage: python csv2fg.py <face_file.csv> [num_parameters] [output_path] [threads]")
+    print("  <face_file.csv>: Path to the CSV file containing face data, or a .npz file written by fg2csv.py")
     print("  [num_parameters]: Optional. Number of parameters (130 or 100). Default is 100.")
     print("  [output_path]: Optional. Path where the output files will be saved. Default is current directory.")
+    print("    A .zip, .tar, .tar.gz, .tar.bz2 or .tar.xz name writes the FG files into that archive instead.")
+    print("  [threads]: Optional. Number of threads writing the output files. Default is 1.")
     print("\nExample:")
     print("  python csv2fg.py faces.csv 130 ./output")
 
-def process_csv(file_path, num_params=100, output_path="."):
+# reads the names and the (N, num_params) coordinates of a face csv in one vectorized parse
+def read_csv(file_path, num_params=100):
     with open(file_path, 'r') as source:
-        csv_reader = csv.reader(source)
-        next(csv_reader)  # Skip header row
-        for row in csv_reader:
-            filename = os.path.join(output_path, row[0])
-            if num_params == 130:
-                writeFG(filename, 
-                        SymShape=[int(i) for i in row[1:51]], 
-                        ASymShape=[int(i) for i in row[51:81]], 
-                        SymTexture=[int(i) for i in row[81:131]])
-            elif num_params == 100:
-                writeFG(filename, 
-                        SymShape=[int(i) for i in row[1:51]], 
-                        SymTexture=[int(i) for i in row[51:101]])
-            else:
-                raise ValueError(f"Invalid number of parameters: {num_params}")
+        next(source)  # Skip header row
+        lines = [line for line in source.read().splitlines() if line.strip()]
+    names = [row[0] for row in csv.reader(lines)]
+    coords = np.loadtxt(lines, delimiter=',', quotechar='"', usecols=range(1, num_params + 1), ndmin=2)
+    return names, coords
+
+def process_csv(file_path, num_params=100, output_path=".", threads=None):
+    if num_params not in (100, 130):
+        raise ValueError(f"Invalid number of parameters: {num_params}")
+    if file_path.endswith('.npz'):
+        names, coords = loadFaces(file_path)
+        names = [name if name.endswith('.fg') else name + '.fg' for name in names]
+    else:
+        names, coords = read_csv(file_path, num_params)
+    if isArchive(output_path):
+        writeArchiveFG(output_path, names, coords)
+    else:
+        writeFGBatch([os.path.join(output_path, name) for name in names], coords, threads)
     print("Done.")
 
 def main():
@@ -58,6 +67,7 @@ def main():
     face_file = sys.argv[1]
     num_params = 100 if len(sys.argv) < 3 or not sys.argv[2].isdigit() else int(sys.argv[2])
     output_path = "." if len(sys.argv) < 4 else sys.argv[3]
+    threads = None if len(sys.argv) < 5 else int(sys.argv[4])
 
     if num_params not in [100, 130]:
         print(f"Error: Number of parameters must be 100 or 130. Got {num_params}")
@@ -65,7 +75,7 @@ def main():
         sys.exit(1)
 
     try:
-        process_csv(face_file, num_params, output_path)
+        process_csv(face_file, num_params, output_path, threads)
         print("Conversion complete. Output saved to: " + output_path)
         # Attempt to delete __pycache__ directory
         shutil.rmtree('__pycache__', ignore_errors=True)
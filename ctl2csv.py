@@ -3,47 +3,76 @@
 import sys
 import os
 import csv
+import hashlib
 import FGBinTools
 
 def print_usage():
-    print("Usage: python ctl2csv.py <input_ctl> <output_csv> [controls_file]")
+    print("Usage: python ctl2csv.py [--incremental] [--npz] <input_ctl> <output_csv> [controls_file]")
+    print("  --incremental: Skip control files that have not changed since their CSV was written")
+    print("  --npz: Write .npz instead of .csv files when converting a directory")
     print("  <input_ctl>: Path to input CTL file or directory containing CTL files")
-    print("  <output_csv>: Path to output CSV file or directory")
+    print("  <output_csv>: Path to output CSV file or directory; a .npz file name writes a binary file instead")
     print("  [controls_file]: Optional. Path to file containing list of controls to convert")
 
 def process_ctl(ctl_file, csv_file, controls=None):
     print(f"Loading control vectors from {ctl_file}...")
 
-    ctl = FGBinTools.readCtl(ctl_file)
+    ctl = FGBinTools.CtlFile(ctl_file)
 
-    controlshapevec = {}
-    controltexvec = {}
-
-    for label, vector in ctl['GS']:
+    for label in ctl.labels['GS']:
         if not controls or label in controls:
             print(f"+ Found: shape {label}")
-            controlshapevec[label] = vector
 
-    for label, vector in ctl['TS']:
+    labels = []
+    for label in ctl.labels['TS']:
         if not controls or label in controls:
             print(f"+ Found: texture {label}")
-            controltexvec[label] = vector
+            if ctl.has(label, 'GS'):
+                labels.append(label)
+
+    if csv_file.endswith('.npz'):
+        labels = sorted(labels)
+        FGBinTools.saveControls(csv_file, labels,
+                                [ctl.slider(label, 'GS') for label in labels],
+                                [ctl.slider(label, 'TS') for label in labels])
+        return
 
     with open(csv_file, 'w', newline='') as csvfile:
         csvWriter = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
 
-        for label in sorted(controltexvec.keys()):
-            row = [label] + controlshapevec[label] + controltexvec[label]
+        for label in sorted(labels):
+            row = [label] + ctl.slider(label, 'GS').tolist() + ctl.slider(label, 'TS').tolist()
             csvWriter.writerow(row)
 
+# Converts ctl_file unless csv_file was already written from the same version of ctl_file with
+# the same controls, as recorded in csv_file.manifest
+def process_ctl_incremental(ctl_file, csv_file, controls=None):
+    manifest_file = csv_file + '.manifest'
+    manifest = FGBinTools.fileManifest([ctl_file])
+    # the list of controls is part of the manifest, so changing it rebuilds the csv
+    manifest['controls'] = (len(controls or []), hash_controls(controls))
+    if os.path.exists(csv_file) and os.path.exists(manifest_file) and FGBinTools.readManifest(manifest_file) == manifest:
+        print(f"Up to date: {csv_file}")
+        return
+    process_ctl(ctl_file, csv_file, controls)
+    FGBinTools.writeManifest(manifest_file, manifest)
+
+def hash_controls(controls):
+    digest = hashlib.sha256('\n'.join(controls or []).encode('utf-8')).hexdigest()
+    return int(digest[:15], 16)
+
 def main():
-    if len(sys.argv) < 3:
+    incremental = '--incremental' in sys.argv
+    binary = '--npz' in sys.argv
+    args = [arg for arg in sys.argv if arg not in ('--incremental', '--npz')]
+    if len(args) < 3:
         print_usage()
         sys.exit(1)
 
-    input_path = sys.argv[1]
-    output_path = sys.argv[2]
-    controls_file = sys.argv[3] if len(sys.argv) > 3 else None
+    input_path = args[1]
+    output_path = args[2]
+    controls_file = args[3] if len(args) > 3 else None
+    convert = process_ctl_incremental if incremental else process_ctl
 
     controls = None
     if controls_file:
@@ -55,10 +84,10 @@ def main():
         for filename in os.listdir(input_path):
             if filename.endswith('.ctl'):
                 ctl_file = os.path.join(input_path, filename)
-                csv_file = os.path.join(output_path, filename.replace('.ctl', '.csv'))
-                process_ctl(ctl_file, csv_file, controls)
+                csv_file = os.path.join(output_path, filename.replace('.ctl', '.npz' if binary else '.csv'))
+                convert(ctl_file, csv_file, controls)
     else:
-        process_ctl(input_path, output_path, controls)
+        convert(input_path, output_path, controls)
 
     print("Done.")
 
@@ -3,43 +3,151 @@
 import sys
 import os
 import csv
+import numpy as np
 import FGBinTools
+import ArchiveTools
 
 def print_usage():
-    print("Usage: python fg2csv.py <input_fg> <output_csv>")
-    print("  <input_fg>: Path to input FG file or directory containing FG files")
-    print("  <output_csv>: Path to output CSV file or directory")
+    print("Usage: python fg2csv.py [--incremental] [--npz] <input_fg> <output_csv> [threads]")
+    print("  --incremental: Only decode FG files that are new or changed since the last run (directories only)")
+    print("  <input_fg>: Path to input FG file, directory containing FG files, or a zip/tar archive of FG files")
+    print("  <output_csv>: Path to output CSV file or directory; a .npz file name writes a binary file instead")
+    print("    A directory receives faces.csv (faces.npz with --npz) when converting a directory or an archive")
+    print("  [threads]: Optional. Number of threads used to read the FG files. Default is 1.")
+    print("  --npz: Write faces.npz instead of faces.csv when <output_csv> is a directory")
 
-def process_fg(fg_file, csv_writer):
-    if fg_file.endswith('.fg'):
-        fgdata = FGBinTools.readFG(fg_file)
-        filename = os.path.basename(fg_file)
-        row = [filename[:-3], filename[12:-3], filename[6:11]] + fgdata['SS'] + fgdata['TS']
-        csv_writer.writerow(row)
+def csv_header():
+    return ['Filename', 'Identity', 'Expression'] + \
+        [f'{section}{i}' for section, width in FGBinTools.FG_SECTIONS for i in range(width)]
+
+def write_rows(csv_writer, names, coords):
+    for name, row in zip(names, coords.tolist()):
+        csv_writer.writerow([name, name[12:], name[6:11]] + row)
+
+# returns the names of the faces that were written
+def process_fg(fg_files, output_file, threads=None):
+    names, coords = FGBinTools.readFGBatch(fg_files, threads)
+    if output_file.endswith('.npz'):
+        FGBinTools.saveFaces(output_file, names, coords)
+        return names
+    with open(output_file, 'w', newline='') as csvfile:
+        csv_writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        csv_writer.writerow(csv_header())
+        write_rows(csv_writer, names, coords)
+    return names
+
+# leaves the FG files that were read but could not be decoded out of the manifest, so that
+# the next incremental run tries them again
+def drop_failed(manifest, fg_files, names):
+    decoded = set(names)
+    for f in fg_files:
+        if os.path.splitext(os.path.basename(f))[0] not in decoded:
+            manifest.pop(os.path.basename(f), None)
+
+# converts the FG files in a zip or tar archive without extracting them, chunk by chunk for csv
+def process_archive(archive_file, output_file):
+    if output_file.endswith('.npz'):
+        names, coords = ArchiveTools.readArchiveFG(archive_file)
+        FGBinTools.saveFaces(output_file, names, coords)
+        return
+    with open(output_file, 'w', newline='') as csvfile:
+        csv_writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        csv_writer.writerow(csv_header())
+        for names, coords in ArchiveTools.iterArchiveFG(archive_file):
+            write_rows(csv_writer, names, coords)
+
+# Updates output_file from a manifest of the FG files it was built from (output_file.manifest).
+# New files are decoded and appended; the csv is only rewritten when files were modified or
+# deleted, and then only the modified files are decoded again. The manifest is written after the
+# output is flushed and also records the size and time of the output itself: if they do not
+# match (a run stopped between the two writes), the rows of all re-decoded files are dropped and
+# the csv is rewritten, so no face is ever listed twice.
+def process_fg_incremental(fg_files, output_file, threads=None):
+    manifest_file = output_file + '.manifest'
+    output_key = os.path.basename(output_file)
+    manifest = FGBinTools.fileManifest(fg_files)
+    if not (os.path.exists(output_file) and os.path.exists(manifest_file)):
+        names = process_fg(fg_files, output_file, threads)
+        drop_failed(manifest, fg_files, names)
+        write_manifest(manifest_file, manifest, output_file)
+        return
+
+    old_manifest = FGBinTools.readManifest(manifest_file)
+    consistent = old_manifest.pop(output_key, None) == FGBinTools.fileManifest([output_file])[output_key]
+    added, modified, deleted = FGBinTools.diffManifest(old_manifest, manifest)
+    paths = {os.path.basename(f): f for f in fg_files}
+    names, coords = FGBinTools.readFGBatch([paths[f] for f in added + modified], threads)
+    drop_failed(manifest, [paths[f] for f in added + modified], names)
+    print(f"{len(added)} new, {len(modified)} modified, {len(deleted)} deleted FG files")
+    if not consistent:
+        print(f"{output_file} changed since its manifest was written, rewriting it")
+    stale = {f[:-3] for f in added + modified + deleted}
+
+    if output_file.endswith('.npz'):
+        old_names, old_coords = FGBinTools.loadFaces(output_file)
+        keep = [name not in stale for name in old_names]
+        FGBinTools.saveFaces(output_file, np.concatenate([old_names[keep], names]),
+                             np.concatenate([old_coords[keep], coords]))
+    elif consistent and not modified and not deleted:
+        with open(output_file, 'a', newline='') as csvfile:
+            csv_writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            write_rows(csv_writer, names, coords)
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+    else:
+        with open(output_file, 'r', newline='') as csvfile:
+            rows = [row for row in csv.reader(csvfile)][1:]
+        tempFile = output_file + '.tmp'
+        with open(tempFile, 'w', newline='') as csvfile:
+            csv_writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            csv_writer.writerow(csv_header())
+            csv_writer.writerows(row for row in rows if row and row[0] not in stale)
+            write_rows(csv_writer, names, coords)
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+        os.replace(tempFile, output_file)
+
+    write_manifest(manifest_file, manifest, output_file)
+
+# writes the manifest of the FG files together with the size and time of the output they were
+# written to (see process_fg_incremental)
+def write_manifest(manifest_file, manifest, output_file):
+    manifest = dict(manifest)
+    manifest.update(FGBinTools.fileManifest([output_file]))
+    FGBinTools.writeManifest(manifest_file, manifest)
+
+# output file for many faces: output_path itself when it is a .csv or .npz file name, otherwise
+# faces.csv (faces.npz with --npz) in the directory output_path
+def output_file_name(output_path, binary=False):
+    if output_path.endswith('.csv') or output_path.endswith('.npz'):
+        if os.path.dirname(output_path):
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        return output_path
+    os.makedirs(output_path, exist_ok=True)
+    return os.path.join(output_path, 'faces.npz' if binary else 'faces.csv')
 
 def main():
-    if len(sys.argv) != 3:
+    incremental = '--incremental' in sys.argv
+    binary = '--npz' in sys.argv
+    args = [arg for arg in sys.argv if arg not in ('--incremental', '--npz')]
+    if len(args) not in (3, 4):
         print_usage()
         sys.exit(1)
 
-    input_path = sys.argv[1]
-    output_path = sys.argv[2]
+    input_path = args[1]
+    output_path = args[2]
+    threads = int(args[3]) if len(args) > 3 else None
 
     if os.path.isdir(input_path):
-        os.makedirs(output_path, exist_ok=True)
-        output_file = os.path.join(output_path, 'faces.csv')
-        with open(output_file, 'w', newline='') as csvfile:
-            csv_writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            csv_writer.writerow(['Filename', 'Identity', 'Expression'] + [f'SS{i}' for i in range(50)] + [f'TS{i}' for i in range(50)])
-            for filename in os.listdir(input_path):
-                if filename.endswith('.fg'):
-                    fg_file = os.path.join(input_path, filename)
-                    process_fg(fg_file, csv_writer)
-    else:
-        with open(output_path, 'w', newline='') as csvfile:
-            csv_writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            csv_writer.writerow(['Filename', 'Identity', 'Expression'] + [f'SS{i}' for i in range(50)] + [f'TS{i}' for i in range(50)])
-            process_fg(input_path, csv_writer)
+        output_file = output_file_name(output_path, binary)
+        if incremental:
+            process_fg_incremental(FGBinTools.listFG(input_path), output_file, threads)
+        else:
+            process_fg(FGBinTools.listFG(input_path), output_file, threads)
+    elif ArchiveTools.isArchive(input_path):
+        process_archive(input_path, output_file_name(output_path, binary))
+    elif input_path.endswith('.fg'):
+        process_fg([input_path], output_path)
 
     print("Done.")
 
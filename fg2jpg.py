@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+
+# Batch-generates jpg files from fg files, like fg2jpg.sh, but runs every face in its own
+# temporary directory so several faces can be rendered at the same time.
+#
+# Usage:
+#  python fg2jpg.py [source path] [target path] [jobs]
+#
+# [source path]: path in which fg files are stored
+# [target path]: path in which jpg files will be saved
+# [jobs]: number of faces rendered at the same time (default: 1)
+#
+# Prerequisite: FaceGen Main SDK CLI 3 (fg3), FaceGen Base Library CLI 3 (fgbl)
+# Place this file under the sdk bin folder with other FaceGen functions (fg3, fgbl);
+# otherwise, fg3 and fgbl should be accessible from everywhere (ie, in the system PATH).
+# The HeadHires model is taken from ~/sdk/data/csam/Animate/Head/HeadHires unless FG_MODEL_DIR is set.
+
+import SDKTools
+
+if __name__ == "__main__":
+    SDKTools.main(SDKTools.FG2JPG, '.fg')
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import FGBinTools
+import MeshTools
+from CorpusTools import FGCorpus
+
+def print_usage():
+    print("Usage: python fg2mesh.py [--format=obj|ply|glb] [--processes=N] <input> <model.egm> <model.tri> <output_dir>")
+    print("  <input>: Directory of FG files or an FG corpus file (.fgc)")
+    print("  <model.egm> / <model.tri>: Statistical shape model and mesh of the FaceGen model (e.g. HeadHires)")
+    print("  <output_dir>: Directory where one mesh file per face is written")
+    print("  --format: obj (text, with texture coordinates), ply (binary) or glb (binary glTF). Default is obj.")
+    print("  --processes: Number of worker processes writing the meshes. Default is the number of CPUs.")
+    print("\nNo FaceGen SDK is needed; the meshes carry the shape of the faces but no color maps.")
+
+def main():
+    fmt = 'obj'
+    processes = None
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('--format='):
+            fmt = arg.split('=', 1)[1].lower()
+        elif arg.startswith('--processes='):
+            processes = int(arg.split('=', 1)[1])
+        else:
+            args.append(arg)
+    if len(args) != 4 or fmt not in MeshTools.MESH_FORMATS:
+        print_usage()
+        sys.exit(1)
+
+    input_path, egm_file, tri_file, output_dir = args
+    model = MeshTools.ShapeModel(egm_file, tri_file)
+    if os.path.isdir(input_path):
+        names, coords = FGBinTools.readFGBatch(FGBinTools.listFG(input_path))
+    else:
+        corpus = FGCorpus(input_path)
+        names, coords = corpus.names, corpus.coords
+
+    files = MeshTools.exportMeshes(names, model.iterSynthesize(coords), MeshTools.MeshTopology(model.tri),
+                                   output_dir, fmt, processes)
+    print(f"Wrote {len(files)} {fmt} meshes to {output_dir}.")
+    print("Done.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import csv
+import FGBinTools
+import SliderTools
+
+def print_usage():
+    print("Usage: python fg_sliders.py eval <input_fg> <ctl> <output_csv>")
+    print("       python fg_sliders.py set [--sections=GS,TS] <input_fg> <ctl> <output_dir> \"label=value\" [\"label+=value\" ...]")
+    print("  eval: Write the value of every slider of the control file for every face")
+    print("  set: Set (label=value) or shift (label+=value) sliders of every face and write the faces to <output_dir>;")
+    print("    all other sliders are held in place")
+    print("  <input_fg>: Path to input FG file or directory containing FG files")
+    print("  --sections: Control sections to change (GS, GA and/or TS, as far as the control file has sliders in them).")
+    print("    Default is every section with a slider of that label.")
+
+def parse_changes(specs):
+    values, deltas = {}, {}
+    for spec in specs:
+        if '+=' in spec:
+            label, value = spec.rsplit('+=', 1)
+            deltas[label] = float(value)
+        else:
+            label, value = spec.rsplit('=', 1)
+            values[label] = float(value)
+    return values, deltas
+
+def main():
+    sections = None
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('--sections='):
+            sections = arg.split('=', 1)[1].split(',')
+        else:
+            args.append(arg)
+    if len(args) < 4 or args[0] not in ('eval', 'set') or (args[0] == 'set' and len(args) < 5):
+        print_usage()
+        sys.exit(1)
+
+    command, input_path, ctl_file, output_path = args[:4]
+    engine = SliderTools.SliderEngine(ctl_file)
+    if sections is not None and not set(sections) <= set(engine.sections):
+        print(f"Error: invalid --sections={','.join(sections)}; {ctl_file} has sliders in: {', '.join(engine.sections)}")
+        print_usage()
+        sys.exit(1)
+    fg_files = FGBinTools.listFG(input_path) if os.path.isdir(input_path) else [input_path]
+    names, coords = FGBinTools.readFGBatch(fg_files)
+
+    if command == 'eval':
+        values = engine.evaluate(coords)
+        with open(output_path, 'w', newline='') as csvfile:
+            csv_writer = csv.writer(csvfile)
+            csv_writer.writerow(['Filename'] + [f'{section}:{label}' for section in values for label in engine.labels(section)])
+            for i, name in enumerate(names):
+                csv_writer.writerow([name] + [value for section in values for value in values[section][i].tolist()])
+    else:
+        values, deltas = parse_changes(args[4:])
+        unknown = [label for label in list(values) + list(deltas)
+                   if not any(label in engine.ctl.index[section] for section in (sections or engine.sections))]
+        if unknown:
+            print("Sliders not found in control file:", ', '.join(unknown))
+            sys.exit(1)
+        coords = engine.apply(coords, values, deltas, sections)
+        os.makedirs(output_path, exist_ok=True)
+        FGBinTools.writeFGBatch([os.path.join(output_path, name + '.fg') for name in names], coords)
+
+    print(f"Processed {len(names)} faces.")
+    print("Done.")
+
+if __name__ == "__main__":
+    main()
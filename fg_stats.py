@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import csv
+import FGBinTools
+import StatTools
+
+def print_usage():
+    print("Usage: python fg_stats.py [--group=regex] [--merge] <input> <output_dir>")
+    print("  <input>: Directory of FG files, an FG corpus file (.fgc), or with --merge a list of")
+    print("    comma-separated stats.npz files saved by earlier runs")
+    print("  <output_dir>: Directory for the prototypes (<group>.fg, and _all.fg for all faces), mean.csv, covariance.csv,")
+    print("    pca_<section>.csv and stats.npz")
+    print("  --group: Regular expression on the file names; faces are grouped by its first group,")
+    print("    e.g. --group=_id(\\d+) for one prototype per identity")
+
+def write_matrix(file_name, header, rows):
+    with open(file_name, 'w', newline='') as csvfile:
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(header)
+        csv_writer.writerows(rows)
+
+def main():
+    key = None
+    merge = False
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('--group='):
+            key = arg.split('=', 1)[1]
+        elif arg == '--merge':
+            merge = True
+        else:
+            args.append(arg)
+    if len(args) != 2:
+        print_usage()
+        sys.exit(1)
+
+    input_path, output_dir = args
+    if merge:
+        parts = input_path.split(',')
+        stats = StatTools.GroupedStats.load(parts[0])
+        for part in parts[1:]:
+            stats.merge(StatTools.GroupedStats.load(part))
+    elif os.path.isdir(input_path):
+        stats = StatTools.statsFromFG(FGBinTools.listFG(input_path), key)
+    else:
+        stats = StatTools.statsFromCorpus(input_path, key)
+
+    os.makedirs(output_dir, exist_ok=True)
+    stats.save(os.path.join(output_dir, 'stats.npz'))
+    prototypes = stats.writePrototypes(output_dir)
+
+    columns = [f'{section}{i}' for section, width in FGBinTools.FG_SECTIONS for i in range(width)]
+    total = stats.total
+    write_matrix(os.path.join(output_dir, 'mean.csv'), ['group', 'n'] + columns,
+                 [['all', total.n] + total.mean.tolist()] +
+                 [[group, s.n] + s.mean.tolist() for group, s in sorted(stats.groups.items())])
+    write_matrix(os.path.join(output_dir, 'covariance.csv'), [''] + columns,
+                 [[column] + row for column, row in zip(columns, total.covariance().tolist())])
+    for section, width in FGBinTools.FG_SECTIONS:
+        if width == 0 or total.n < 2:
+            continue
+        eigenvalues, components = total.pca(section)
+        write_matrix(os.path.join(output_dir, f'pca_{section}.csv'), ['variance'] + [f'{section}{i}' for i in range(width)],
+                     [[value] + row for value, row in zip(eigenvalues.tolist(), components.tolist())])
+
+    print(f"Statistics of {total.n} faces, {len(prototypes)} prototypes written.")
+    print("Done.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import csv
+import FGBinTools
+import SearchTools
+
+def print_usage():
+    print("Usage: python find_duplicates.py [--space=sym|SS|SA|TS|all] [--cosine] <input> <threshold> <output_csv>")
+    print("  <input>: Directory of FG files or an FG corpus file (.fgc)")
+    print("  <threshold>: Largest distance between two faces that are reported as near-duplicates")
+    print("    (in .fg coordinate units; 1 - cosine similarity with --cosine)")
+    print("  <output_csv>: Pairs of near-duplicate faces and their distance, closest first")
+    print("  --space: Coordinates to compare. Default is sym (SS and TS).")
+
+def main():
+    space = 'sym'
+    metric = 'euclidean'
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('--space='):
+            space = arg.split('=', 1)[1]
+        elif arg == '--cosine':
+            metric = 'cosine'
+        else:
+            args.append(arg)
+    if len(args) != 3:
+        print_usage()
+        sys.exit(1)
+
+    input_path, threshold, output_file = args[0], float(args[1]), args[2]
+    if os.path.isdir(input_path):
+        index = SearchTools.FaceIndex.fromFG(FGBinTools.listFG(input_path), space, metric)
+    else:
+        index = SearchTools.FaceIndex.fromCorpus(input_path, space, metric)
+
+    pairs, distances = index.duplicates(threshold)
+    with open(output_file, 'w', newline='') as csvfile:
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(['face1', 'face2', 'distance'])
+        for (i, j), distance in zip(pairs.tolist(), distances.tolist()):
+            csv_writer.writerow([index.names[i], index.names[j], distance])
+
+    print(f"Found {len(pairs)} near-duplicate pairs among {len(index)} faces.")
+    print("Done.")
+
+if __name__ == "__main__":
+    main()
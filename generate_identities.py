@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import numpy as np
+import IdentityTools
+import ModelTools
+
+SOCIAL_DIMENSIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'si-todorov.csv')
+
+def print_usage():
+    print("Usage: python generate_identities.py [options] <n_identities> <output> [models]")
+    print("  <n_identities>: Number of identities to select")
+    print("  <output>: Directory for the FG files, or an FG corpus file (.fgc) to append the faces to;")
+    print("    the projections of the identities are written to <output>_projections.csv")
+    print("  [models]: Optional. Models to project the identities on. Default is si-todorov.csv.")
+    print("  --candidates=N: Number of simulated candidates. Default is 1000.")
+    print("  --method=auto|removal|farthest: Selection method. Default is auto (removal up to")
+    print(f"    {IdentityTools.REMOVAL_MAX_CANDIDATES} candidates, farthest-point selection above).")
+    print("  --seed=N: Random seed. Default is 2, as in generate_identities.r.")
+    print("  --sigma=X, --scale=X: Standard deviation and scaling factor of the candidates. Defaults are 1 and 0.5.")
+
+def main():
+    options = {'candidates': '1000', 'method': 'auto', 'seed': '2', 'sigma': '1', 'scale': '0.5'}
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('--') and arg[2:].split('=', 1)[0] in options:
+            key, value = arg[2:].split('=', 1)
+            options[key] = value
+        else:
+            args.append(arg)
+    if len(args) not in (2, 3):
+        print_usage()
+        sys.exit(1)
+
+    n_identities = int(args[0])
+    output = args[1]
+    models_file = args[2] if len(args) > 2 else SOCIAL_DIMENSIONS
+
+    candidates = IdentityTools.simulateIdentities(int(options['candidates']), int(options['seed']),
+                                                  sigma=float(options['sigma']), scalingFactor=float(options['scale']))
+    selected = IdentityTools.selectDiverse(candidates, n_identities, options['method'])
+    coords = np.rint(candidates[selected] * 1000)
+
+    names = [f'id{i + 1:0{len(str(len(selected)))}d}' for i in range(len(selected))]
+    if not ModelTools.writeFaces(output, names, coords):
+        sys.exit(1)
+
+    labels, models = ModelTools.readModels(models_file)
+    projections_file = os.path.splitext(output.rstrip(os.sep))[0] + '_projections.csv'
+    ModelTools.writeProjectionsCsv(projections_file, names, labels, coords, models)
+
+    print(f"Selected {len(selected)} of {len(candidates)} candidates.")
+    print("Done.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+
+import sys
+import ModelTools
+
+def print_usage():
+    print("Usage: python project_models.py <identities> <models> <output_csv> [model1 model2 ...]")
+    print("  <identities>: Directory of FG files, an FG corpus file, a faces .npz file or an identities csv")
+    print("  <models>: Control file (.ctl), controls .npz file or models csv (e.g. si-todorov.csv)")
+    print("  <output_csv>: One row per identity and projection type (shape.and.texture, shape.only, texture.only),")
+    print("    one column per model; models are scaled by 1000 to match .fg coordinates, as in vary_on_model.R")
+    print("  [model1 model2 ...]: Optional. Models to project on. Default is every model.")
+
+def main():
+    if len(sys.argv) < 4:
+        print_usage()
+        sys.exit(1)
+
+    identities_file, models_file, output_file = sys.argv[1:4]
+    labels, models = ModelTools.readModels(models_file, sys.argv[4:] or None)
+    names, identities = ModelTools.loadIdentities(identities_file)
+
+    ModelTools.writeProjectionsCsv(output_file, names, labels, identities, models)
+
+    print(f"Projected {len(names)} identities on {len(labels)} models.")
+    print("Done.")
+
+if __name__ == "__main__":
+    main()
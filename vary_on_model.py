@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import csv
+import numpy as np
+import ModelTools
+
+def print_usage():
+    print("Usage: python vary_on_model.py [--add] [--levels=from:to:n] [--texture-levels=from:to:n] <identities> <models> <output> [model1 model2 ...]")
+    print("  <identities>: Directory of FG files, an FG corpus file, a faces .npz file or an identities csv")
+    print("  <models>: Control file (.ctl), controls .npz file or models csv (e.g. si-todorov.csv)")
+    print("  <output>: Directory for the FG files, or an FG corpus file (.fgc) to append the faces to;")
+    print("    the points are listed in <output>_points.csv")
+    print("  [model1 model2 ...]: Optional. Models to vary the identities on. Default is every model.")
+    print("  --levels: Shape projections of the points. Default is -3:3:7.")
+    print("  --texture-levels: Texture projections of the points. Default is the shape levels.")
+    print("  --add: Levels are added to each identity's own projections (as vary_on_model_add.R)")
+
+def parse_levels(value):
+    start, stop, count = value.split(':')
+    return np.linspace(float(start), float(stop), int(count))
+
+def main():
+    relative = False
+    shape_levels = parse_levels('-3:3:7')
+    texture_levels = None
+    args = []
+    for arg in sys.argv[1:]:
+        if arg == '--add':
+            relative = True
+        elif arg.startswith('--levels='):
+            shape_levels = parse_levels(arg.split('=', 1)[1])
+        elif arg.startswith('--texture-levels='):
+            texture_levels = parse_levels(arg.split('=', 1)[1])
+        else:
+            args.append(arg)
+    if len(args) < 3:
+        print_usage()
+        sys.exit(1)
+
+    identities_file, models_file, output = args[:3]
+    labels, models = ModelTools.readModels(models_file, args[3:] or None)
+    names, identities = ModelTools.loadIdentities(identities_file)
+
+    coords, closest, levels = ModelTools.varyOnModels(identities, models, shape_levels, texture_levels, relative)
+    faces = ModelTools.writeVariations(output, names, labels, coords)
+    if faces is False:
+        sys.exit(1)
+
+    points_file = os.path.splitext(output.rstrip(os.sep))[0] + '_points.csv'
+    with open(points_file, 'w', newline='') as csvfile:
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(['face', 'identity', 'manipulated.trait', 'identity.point.shape', 'identity.point.texture',
+                             'point', 'projection.shape', 'projection.texture'])
+        face = iter(faces)
+        for i, name in enumerate(names):
+            for d, label in enumerate(labels):
+                for point in range(coords.shape[2]):
+                    csv_writer.writerow([next(face), name, label, closest[i, d, 0] + 1, closest[i, d, 1] + 1,
+                                         point + 1, levels[i, d, point, 0], levels[i, d, point, 1]])
+
+    print(f"Wrote {len(faces)} faces.")
+    print("Done.")
+
+if __name__ == "__main__":
+    main()